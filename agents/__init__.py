@@ -1,15 +1,22 @@
-from .document_processor import DocumentProcessorAgent
-from .ocr_agent import OCRAgent
-from .image_extractor import ImageExtractorAgent
-from .structure_analyzer import StructureAnalyzerAgent
-from .json_generator import JSONGeneratorAgent
-from .grading_agent import GradingAgent
-
-__all__ = [
-    'DocumentProcessorAgent',
-    'OCRAgent',
-    'ImageExtractorAgent',
-    'StructureAnalyzerAgent',
-    'JSONGeneratorAgent',
-    'GradingAgent'
-]
+import importlib
+
+# Agents are imported on first access (PEP 562), so importing one agent
+# does not pull in the heavy dependencies of all the others
+_AGENTS = {
+    'DocumentProcessorAgent': '.document_processor',
+    'OCRAgent': '.ocr_agent',
+    'ImageExtractorAgent': '.image_extractor',
+    'StructureAnalyzerAgent': '.structure_analyzer',
+    'JSONGeneratorAgent': '.json_generator',
+    'GradingAgent': '.grading_agent'
+}
+
+__all__ = list(_AGENTS)
+
+
+def __getattr__(name):
+    if name in _AGENTS:
+        value = getattr(importlib.import_module(_AGENTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
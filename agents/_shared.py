@@ -0,0 +1,45 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.image_tools import ImageProcessor
+from utils.ocr_tools import OCREngine
+from utils.vision_api import ClaudeVisionAPI
+
+
+@functools.lru_cache(maxsize=None)
+def get_image_processor() -> ImageProcessor:
+    """Image processor shared by all agents"""
+    return ImageProcessor()
+
+
+@functools.lru_cache(maxsize=None)
+def get_ocr_engine() -> OCREngine:
+    """
+    OCR engine shared by all agents
+    
+    The EasyOCR reader holds its detection and recognition models in (GPU)
+    memory, so they are loaded once per process rather than per OCRAgent.
+    """
+    return OCREngine()
+
+
+@functools.lru_cache(maxsize=None)
+def get_vision_api() -> ClaudeVisionAPI:
+    """
+    Claude Vision client shared by all agents
+    
+    One instance keeps one HTTP connection pool (and one cost tally) for the
+    whole pipeline instead of a separate TLS session per agent.
+    """
+    return ClaudeVisionAPI()
+
+
+@functools.lru_cache(maxsize=None)
+def get_diagram_save_pool() -> ThreadPoolExecutor:
+    """
+    Background writer pool for extracted diagrams, shared by all agents
+    
+    Process-wide so its threads are not leaked per ImageExtractorAgent; callers
+    wait on the futures they submit rather than shutting the pool down.
+    """
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="diagram-save")
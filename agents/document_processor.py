@@ -1,10 +1,15 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+import numpy as np
 from PIL import Image
 from loguru import logger
 
+from utils.page_cache import PageCache
 from utils.pdf_tools import PDFProcessor
-from utils.image_tools import ImageProcessor
+from agents._shared import get_image_processor
 from config.settings import settings
 
 
@@ -13,7 +18,12 @@ class DocumentProcessorAgent:
     
     def __init__(self):
         self.pdf_processor = PDFProcessor()
-        self.image_processor = ImageProcessor()
+        self.image_processor = get_image_processor()
+        
+        # Rendered pages across runs, keyed by PDF content, DPI and output dir
+        self.page_cache = None
+        if settings.enable_page_cache:
+            self.page_cache = PageCache(settings.temp_dir / "page_cache")
     
     def process_document(self, pdf_path: str, 
                         output_subdir: str = "processed") -> Tuple[List[str], List[float]]:
@@ -29,36 +39,88 @@ class DocumentProcessorAgent:
         """
         logger.info(f"Processing document: {pdf_path}")
         
-        # Convert PDF to images
-        images = self.pdf_processor.convert_to_images(pdf_path)
-        logger.info(f"Converted to {len(images)} images")
+        output_dir = settings.images_dir / output_subdir
         
-        # Preprocess each image
-        processed_images = []
-        quality_scores = []
+        key = None
+        if self.page_cache is not None:
+            key = self.page_cache.key(pdf_path, str(self.pdf_processor.dpi), str(output_dir))
+            cached = self._cached_pages(key)
+            if cached is not None:
+                logger.success(f"Reusing {len(cached[0])} rendered pages for {pdf_path}")
+                return cached
         
-        for i, img in enumerate(images, 1):
-            logger.debug(f"Preprocessing page {i}/{len(images)}")
-            
-            # Preprocess for OCR
-            processed = self.image_processor.preprocess_for_ocr(img)
-            processed_images.append(processed)
-            
-            # Assess quality
-            quality = self.image_processor.assess_image_quality(processed)
-            quality_scores.append(quality)
-            
-            logger.debug(f"Page {i} quality score: {quality:.2f}")
+        output_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save processed images
-        output_dir = settings.images_dir / output_subdir
-        image_paths = self.pdf_processor.save_images(
-            processed_images, 
-            str(output_dir),
-            prefix="page"
-        )
+        # Pages stream from the renderer into the pool, which preprocesses and
+        # saves them (OpenCV and PNG encoding release the GIL). Rendering
+        # overlaps with preprocessing, and at most two pages per worker are
+        # held in memory at once
+        max_workers = settings.max_page_workers or os.cpu_count() or 1
+        page_results = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = deque()
+            for page_num, img in enumerate(self.pdf_processor.iter_pages(pdf_path), 1):
+                in_flight.append(executor.submit(self._process_page, img, page_num, output_dir))
+                if len(in_flight) >= 2 * max_workers:
+                    page_results.append(in_flight.popleft().result())
+            page_results.extend(future.result() for future in in_flight)
+        
+        image_paths = [path for path, _ in page_results]
+        quality_scores = np.fromiter((quality for _, quality in page_results),
+                                     dtype=np.float32, count=len(page_results))
+        
+        avg_quality = float(quality_scores.mean())
+        logger.success(f"Processed {len(image_paths)} pages, avg quality: {avg_quality:.2f}")
+        
+        if key is not None:
+            self._store_pages(key, image_paths, quality_scores.tolist())
+        
+        return image_paths, quality_scores.tolist()
+    
+    def _cached_pages(self, key: str) -> Optional[Tuple[List[str], List[float]]]:
+        """
+        Previously rendered pages for a cache key, or None
+        
+        A hit only counts if every page file is still the one written for this
+        key; another PDF rendered into the same directory invalidates it.
+        """
+        manifest = self.page_cache.get(key)
+        if manifest is None:
+            return None
+        
+        for image_path, (mtime_ns, size) in zip(manifest['image_paths'], manifest['stats']):
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                return None
+            if stat.st_mtime_ns != mtime_ns or stat.st_size != size:
+                return None
+        
+        return manifest['image_paths'], manifest['quality_scores']
+    
+    def _store_pages(self, key: str, image_paths: List[str], quality_scores: List[float]):
+        """Cache rendered page paths and scores, with file stats to detect overwrites"""
+        stats = []
+        for image_path in image_paths:
+            stat = os.stat(image_path)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        
+        self.page_cache.put(key, {
+            'image_paths': image_paths,
+            'quality_scores': quality_scores,
+            'stats': stats,
+        })
+    
+    def _process_page(self, img: Image.Image, page_num: int, output_dir: Path) -> Tuple[str, float]:
+        """Preprocess a single page, assess its quality and save it"""
+        logger.debug("Preprocessing page {}", page_num)
+        
+        # Preprocess for OCR
+        processed = self.image_processor.preprocess_for_ocr(img)
+        
+        # Assess quality
+        quality = self.image_processor.assess_image_quality(processed)
         
-        avg_quality = sum(quality_scores) / len(quality_scores)
-        logger.success(f"Processed {len(images)} pages, avg quality: {avg_quality:.2f}")
+        logger.debug("Page {} quality score: {:.2f}", page_num, quality)
         
-        return image_paths, quality_scores
+        return self.pdf_processor.save_image(processed, output_dir, page_num), quality
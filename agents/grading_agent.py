@@ -1,29 +1,110 @@
-from typing import List, Dict, Tuple
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional, Tuple
+import bisect
+import difflib
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
-from sentence_transformers import SentenceTransformer
 import numpy as np
 
 from models.schemas import (Question, Answer, GradingResult, PartialCreditBreakdown,
                             QuestionType, GradingReport)
 from utils.math_utils import MathProcessor
-from utils.vision_api import ClaudeVisionAPI
+from utils.semantic_cache import SemanticCache
+from agents._shared import get_vision_api
 from config.settings import settings
 
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+# MCQ option patterns in priority order: "a)", "(a)", "a.", standalone "a"
+MCQ_OPTION_PATTERNS = (
+    re.compile(r'\b([a-e])\)'),
+    re.compile(r'\(([a-e])\)'),
+    re.compile(r'\b([a-e])\.'),
+    re.compile(r'\b([a-e])\b'),
+)
+
+# Letter grade boundaries: a percentage at or above GRADE_CUTOFFS[i] earns GRADE_LABELS[i + 1]
+GRADE_CUTOFFS = [45, 50, 55, 60, 65, 70, 75, 80, 85, 90]
+GRADE_LABELS = ['F', 'D', 'C-', 'C', 'C+', 'B-', 'B', 'B+', 'A-', 'A', 'A+']
+
 
 class GradingAgent:
     """Agent for grading student answers with multiple strategies"""
     
+    # Upper bound on cached embeddings (one 384-d vector per unique text)
+    EMBEDDING_CACHE_SIZE = 4096
+    
+    # Grading method per question type; other types use _grade_short_answer
+    GRADERS = {
+        QuestionType.MCQ: '_grade_mcq',
+        QuestionType.NUMERICAL: '_grade_numerical',
+        QuestionType.DERIVATION: '_grade_derivation',
+        QuestionType.PROOF: '_grade_derivation',
+        QuestionType.DIAGRAM: '_grade_diagram',
+    }
+    
     def __init__(self):
         self.math_processor = MathProcessor()
-        self.vision_api = ClaudeVisionAPI()
+        self.vision_api = get_vision_api()
+        
+        # L2-normalized embeddings keyed by text digest, shared across students
+        self._embedding_cache: Dict[str, np.ndarray] = {}
+        # Answers are graded on worker threads; eviction must not interleave
+        self._embedding_lock = threading.Lock()
+        
+        # AI grading responses reused across identical answers
+        self.grading_cache = None
+        if settings.enable_grading_cache:
+            self.grading_cache = SemanticCache(
+                threshold=settings.grading_cache_threshold,
+                cache_dir=settings.temp_dir / "grading_cache"
+            )
         
-        # Load sentence transformer for semantic similarity
+        # Sentence transformer for semantic similarity, loaded on first use
+        self._similarity_model = None
+        self._similarity_model_loaded = False
+        self._similarity_model_lock = threading.Lock()
+    
+    @property
+    def similarity_model(self) -> Optional['SentenceTransformer']:
+        """Semantic similarity model (None if it failed to load)"""
+        if not self._similarity_model_loaded:
+            with self._similarity_model_lock:
+                if not self._similarity_model_loaded:
+                    self._similarity_model = self._load_similarity_model()
+                    self._similarity_model_loaded = True
+        return self._similarity_model
+    
+    def _load_similarity_model(self) -> Optional['SentenceTransformer']:
+        """Load sentence transformer for semantic similarity"""
         try:
-            self.similarity_model = SentenceTransformer('all-MiniLM-L6-v2')
+            # Imported here: sentence_transformers pulls in torch, which is slow to import
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer('all-MiniLM-L6-v2')
+            if settings.quantize_similarity_model and model.device.type == 'cpu':
+                model = self._quantize_model(model)
             logger.info("Semantic similarity model loaded")
+            return model
         except Exception as e:
             logger.warning(f"Failed to load similarity model: {e}")
-            self.similarity_model = None
+            return None
+    
+    @staticmethod
+    def _quantize_model(model: 'SentenceTransformer') -> 'SentenceTransformer':
+        """Apply INT8 dynamic quantization to the model's Linear layers (CPU only)"""
+        try:
+            import torch
+            quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear},
+                                                            dtype=torch.qint8)
+            logger.info("Semantic similarity model quantized to INT8")
+            return quantized
+        except Exception as e:
+            logger.warning(f"Model quantization failed, using FP32: {e}")
+            return model
     
     def grade_answer_sheet(self, questions: List[Question], 
                           answers: List[Answer],
@@ -41,32 +122,40 @@ class GradingAgent:
         """
         logger.info(f"Grading answer sheet for student {student_info.get('name', 'Unknown')}")
         
-        results = []
-        total_marks_available = 0.0
-        total_marks_awarded = 0.0
+        # The Vision client is shared across agents, so report only this sheet's spend
+        start_cost = self.vision_api.get_total_cost()
         
         # Create question lookup
-        question_map = {q.question_number: q for q in questions}
+        lookup_question = self._build_question_lookup(questions)
         
-        # Grade each answer
+        # Pair each answer with its question
+        graded_pairs = []
         for answer in answers:
             q_num = answer.question_number
+            question = lookup_question(q_num)
             
-            if q_num not in question_map:
+            if question is None:
                 logger.warning(f"Question {q_num} not found in question paper")
                 continue
             
-            question = question_map[q_num]
-            
-            # Grade the answer
-            result = self._grade_single_answer(question, answer)
-            results.append(result)
-            
-            total_marks_available += result.marks_available
-            total_marks_awarded += result.marks_awarded
-            
-            if settings.verbose:
-                logger.info(f"Q{q_num}: {result.marks_awarded:.1f}/{result.marks_available:.1f} "
+            graded_pairs.append((question, answer))
+        
+        # Encode all short-answer texts in one batch before grading
+        self._prefetch_embeddings(graded_pairs)
+        
+        # Grade all answers, overlapping the AI calls
+        results = self._grade_answers(graded_pairs)
+        
+        # Persist new AI grades once per sheet rather than per answer
+        if self.grading_cache:
+            self.grading_cache.flush()
+        
+        total_marks_available = sum(r.marks_available for r in results)
+        total_marks_awarded = sum(r.marks_awarded for r in results)
+        
+        if settings.verbose:
+            for result in results:
+                logger.info(f"Q{result.question_number}: {result.marks_awarded:.1f}/{result.marks_available:.1f} "
                           f"({result.grading_method})")
         
         # Calculate percentage and grade
@@ -82,7 +171,7 @@ class GradingAgent:
             percentage=percentage,
             grade=grade,
             processing_time=0.0,  # Will be updated by caller
-            api_cost=self.vision_api.get_total_cost()
+            api_cost=self.vision_api.get_total_cost() - start_cost
         )
         
         logger.success(f"Grading complete: {total_marks_awarded:.1f}/{total_marks_available:.1f} "
@@ -90,6 +179,65 @@ class GradingAgent:
         
         return report
     
+    @staticmethod
+    def _build_question_lookup(questions: List[Question]) -> Callable[[str], Optional[Question]]:
+        """
+        Build a question-number lookup
+        
+        Dense integer numbering ("1".."N") is served from a list indexed by
+        number; anything else (e.g. "2a") falls back to a dict.
+        """
+        if questions and all(q.question_number.isdecimal() and
+                             q.question_number == str(int(q.question_number))
+                             for q in questions):
+            numbers = [int(q.question_number) for q in questions]
+            max_q = max(numbers)
+            if max_q <= 2 * len(questions):
+                q_arr: List[Optional[Question]] = [None] * (max_q + 1)
+                for num, q in zip(numbers, questions):
+                    q_arr[num] = q  # later duplicates win, as with a dict
+                
+                def lookup(q_num: str) -> Optional[Question]:
+                    if not q_num.isdecimal() or q_num != str(int(q_num)):
+                        return None
+                    num = int(q_num)
+                    return q_arr[num] if num <= max_q else None
+                
+                return lookup
+        
+        return {q.question_number: q for q in questions}.get
+    
+    def _grade_answers(self, graded_pairs: List[Tuple[Question, Answer]]) -> List[GradingResult]:
+        """
+        Grade answers concurrently, bounded by max_concurrent_api_calls
+        
+        The API client is synchronous, so a thread pool overlaps the AI calls;
+        local grading (e.g. sp.simplify for numerical answers) runs on the pool
+        too instead of holding up the remaining answers.
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, settings.max_concurrent_api_calls)) as executor:
+            futures = [executor.submit(self._grade_single_answer, question, answer)
+                       for question, answer in graded_pairs]
+            
+            for (question, _), future in zip(graded_pairs, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.error(f"Grading failed for Q{question.question_number}: {e}")
+                    results.append(GradingResult(
+                        question_number=question.question_number,
+                        marks_available=question.marks,
+                        marks_awarded=0.0,
+                        is_correct=False,
+                        partial_credit=None,
+                        feedback=f"Grading error: {str(e)}",
+                        confidence=0.0,
+                        grading_method="ai_grading"
+                    ))
+        
+        return results
+    
     def _grade_single_answer(self, question: Question, answer: Answer) -> GradingResult:
         """Grade a single answer based on question type"""
         
@@ -112,27 +260,18 @@ class GradingAgent:
             logger.info(f"No correct answer for Q{question.question_number}, using AI grading")
             return self._grade_with_ai(question, answer)
         
-        if question.question_type == QuestionType.MCQ:
-            return self._grade_mcq(question, answer)
-        elif question.question_type == QuestionType.NUMERICAL:
-            return self._grade_numerical(question, answer)
-        elif question.question_type == QuestionType.DERIVATION or question.question_type == QuestionType.PROOF:
-            return self._grade_derivation(question, answer)
-        elif question.question_type == QuestionType.DIAGRAM:
-            return self._grade_diagram(question, answer)
-        else:  # SHORT_ANSWER, ESSAY, CODE
-            return self._grade_short_answer(question, answer)
+        grader = getattr(self, self.GRADERS.get(question.question_type, '_grade_short_answer'))
+        return grader(question, answer)
     
     def _grade_with_ai(self, question: Question, answer: Answer) -> GradingResult:
         """Grade any question type using AI when no correct answer is available"""
         
         try:
             # Use Claude Vision API for grading based on question text only
-            grading_response = self.vision_api.grade_answer(
-                question_type=question.question_type.value,
-                marks=question.marks,
+            grading_response = self._grade_answer_cached(
+                question,
                 correct_answer="",  # No sample answer available
-                student_answer=answer.answer_text + (f"\n\nWorking:\n{answer.working}" if answer.working else ""),
+                student_answer=answer.full_text,
                 question_text=question.question_text  # Provide question text for context
             )
             
@@ -176,14 +315,76 @@ class GradingAgent:
                 grading_method="ai_grading"
             )
     
+    def _grade_answer_cached(self, question: Question, correct_answer: str,
+                             student_answer: str, question_text: str = "") -> Dict:
+        """Grade with the AI, reusing responses for repeated answers"""
+        if not self.grading_cache or not self.similarity_model:
+            return self.vision_api.grade_answer(
+                question_type=question.question_type.value,
+                marks=question.marks,
+                correct_answer=correct_answer,
+                student_answer=student_answer,
+                question_text=question_text
+            )
+        
+        # One cache partition per question and reference answer
+        namespace = self._text_key(
+            f"{question.question_number}\x00{question.marks}\x00{question_text}\x00{correct_answer}"
+        )
+        
+        embedding = None
+        try:
+            # Past max_seq_length the encoder truncates, so long answers that
+            # only differ further on would share an embedding; don't cache them
+            if not self._exceeds_max_seq_length(student_answer):
+                embedding = self._encode_cached(student_answer)
+        except Exception as e:
+            logger.warning(f"Grading cache unavailable: {e}")
+        
+        if embedding is not None:
+            cached = self.grading_cache.lookup(namespace, embedding, student_answer)
+            if cached is not None:
+                logger.info(f"Reusing cached AI grade for Q{question.question_number}")
+                return cached
+        
+        response = self.vision_api.grade_answer(
+            question_type=question.question_type.value,
+            marks=question.marks,
+            correct_answer=correct_answer,
+            student_answer=student_answer,
+            question_text=question_text
+        )
+        
+        # Don't cache failed gradings
+        if embedding is not None and response.get('confidence', 0.0) > 0:
+            self.grading_cache.store(namespace, embedding, student_answer, response)
+        
+        return response
+    
+    def _exceeds_max_seq_length(self, text: str) -> bool:
+        """Check whether the similarity model would truncate a text"""
+        model = self.similarity_model
+        return len(model.tokenizer.tokenize(text)) > model.max_seq_length
+    
     def _grade_mcq(self, question: Question, answer: Answer) -> GradingResult:
         """Grade MCQ - exact match only"""
         
-        # Extract option letter from answer
-        answer_letter = self._extract_mcq_option(answer.answer_text)
-        correct_letter = self._extract_mcq_option(question.correct_answer or "")
+        answer_norm = answer.answer_text.strip().lower()
+        correct_norm = (question.correct_answer or "").strip().lower()
+        
+        if answer_norm == correct_norm:
+            # Identical text always selects the same option: extract it once, for the feedback
+            answer_letter = correct_letter = self._extract_mcq_option(answer_norm) or answer_norm
+            is_correct = True
+        elif not answer_norm or not correct_norm:
+            answer_letter, correct_letter = answer_norm, correct_norm
+            is_correct = False
+        else:
+            # Extract option letter from answer
+            answer_letter = self._extract_mcq_option(answer_norm)
+            correct_letter = self._extract_mcq_option(correct_norm)
+            is_correct = (answer_letter == correct_letter)
         
-        is_correct = (answer_letter == correct_letter)
         marks = question.marks if is_correct else 0.0
         
         feedback = f"Selected: {answer_letter}, Correct: {correct_letter}"
@@ -275,11 +476,10 @@ class GradingAgent:
             return self._grade_short_answer(question, answer)
         
         # Use Claude Vision API for detailed grading
-        grading_response = self.vision_api.grade_answer(
-            question_type=question.question_type.value,
-            marks=question.marks,
+        grading_response = self._grade_answer_cached(
+            question,
             correct_answer=question.correct_answer or "",
-            student_answer=answer.answer_text + (f"\n\nWorking:\n{answer.working}" if answer.working else "")
+            student_answer=answer.full_text
         )
         
         marks_awarded = grading_response.get('marks_awarded', 0.0)
@@ -329,14 +529,15 @@ class GradingAgent:
                 grading_method="diagram_comparison"
             )
         
-        # Load diagrams
+        # Load diagrams as encoded bytes; small ones are forwarded to the API as-is
         try:
-            from PIL import Image
-            correct_img = Image.open(question.diagram_path)
-            student_img = Image.open(answer.diagram_path)
+            with open(question.diagram_path, 'rb') as f:
+                correct_bytes = f.read()
+            with open(answer.diagram_path, 'rb') as f:
+                student_bytes = f.read()
             
             # Compare with AI
-            comparison = self.vision_api.compare_diagrams(correct_img, student_img)
+            comparison = self.vision_api.compare_diagrams(correct_bytes, student_bytes)
             
             similarity_score = comparison.get('similarity_score', 0.0)
             
@@ -411,9 +612,8 @@ class GradingAgent:
         elif similarity >= 0.6:
             # Medium similarity - verify with AI
             logger.info(f"Medium similarity ({similarity:.2f}), verifying with AI")
-            ai_result = self.vision_api.grade_answer(
-                question_type=question.question_type.value,
-                marks=question.marks,
+            ai_result = self._grade_answer_cached(
+                question,
                 correct_answer=question.correct_answer or "",
                 student_answer=answer.answer_text
             )
@@ -426,9 +626,8 @@ class GradingAgent:
             # Low similarity - check with AI for partial credit
             if settings.enable_partial_credit:
                 logger.info(f"Low similarity ({similarity:.2f}), checking for partial credit")
-                ai_result = self.vision_api.grade_answer(
-                    question_type=question.question_type.value,
-                    marks=question.marks,
+                ai_result = self._grade_answer_cached(
+                    question,
                     correct_answer=question.correct_answer or "",
                     student_answer=answer.answer_text
                 )
@@ -455,18 +654,106 @@ class GradingAgent:
             grading_method=method
         )
     
+    def _prefetch_embeddings(self, graded_pairs: List[Tuple[Question, Answer]]):
+        """Batch-encode texts of answers that will be graded by semantic similarity"""
+        texts = []
+        for question, answer in graded_pairs:
+            if not self._uses_semantic_similarity(question, answer):
+                continue
+            if self._lexical_similarity(question.correct_answer, answer.answer_text) is not None:
+                continue
+            texts.append(question.correct_answer)
+            texts.append(answer.answer_text)
+        
+        # Only encode unique texts that are not cached yet
+        pending = {}
+        with self._embedding_lock:
+            for text in texts:
+                key = self._text_key(text)
+                if key not in self._embedding_cache:
+                    pending[key] = text
+        
+        # Only touch (and load) the model when there is something to encode
+        if not pending or not self.similarity_model:
+            return
+        
+        try:
+            embeddings = self.similarity_model.encode(list(pending.values()), batch_size=64,
+                                                      normalize_embeddings=True,
+                                                      convert_to_numpy=True)
+            for key, embedding in zip(pending, embeddings):
+                self._store_embedding(key, embedding)
+            logger.debug(f"Pre-encoded {len(pending)} texts for semantic similarity")
+        except Exception as e:
+            # Missing entries are encoded on demand by _encode_cached
+            logger.warning(f"Batch encoding failed: {e}")
+    
+    def _uses_semantic_similarity(self, question: Question, answer: Answer) -> bool:
+        """Check whether an answer will be routed to _grade_short_answer"""
+        if not answer.answer_text or answer.answer_text == "[No answer provided]":
+            return False
+        if not question.correct_answer or question.correct_answer.strip() == "":
+            return False
+        if question.question_type in (QuestionType.DERIVATION, QuestionType.PROOF):
+            return not settings.enable_partial_credit
+        return question.question_type not in (QuestionType.MCQ, QuestionType.NUMERICAL,
+                                              QuestionType.DIAGRAM)
+    
+    @staticmethod
+    def _text_key(text: str) -> str:
+        """Cache key for a text's embedding"""
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    def _store_embedding(self, key: str, embedding: np.ndarray):
+        """Insert an embedding into the bounded cache"""
+        with self._embedding_lock:
+            if key not in self._embedding_cache and len(self._embedding_cache) >= self.EMBEDDING_CACHE_SIZE:
+                # Evict the oldest entry (dicts preserve insertion order)
+                self._embedding_cache.pop(next(iter(self._embedding_cache)))
+            self._embedding_cache[key] = embedding
+    
+    def _encode_cached(self, text: str) -> np.ndarray:
+        """Encode text to an L2-normalized embedding, memoized by content hash"""
+        key = self._text_key(text)
+        
+        with self._embedding_lock:
+            embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            # Encoded outside the lock; a concurrent miss on the same text just encodes twice
+            embedding = self.similarity_model.encode([text], normalize_embeddings=True,
+                                                     convert_to_numpy=True)[0]
+            self._store_embedding(key, embedding)
+        
+        return embedding
+    
+    @staticmethod
+    def _lexical_similarity(text1: str, text2: str) -> Optional[float]:
+        """Similarity for identical or near-identical texts, None if the encoder is needed"""
+        a = text1.strip()
+        b = text2.strip()
+        if not a or not b:
+            return None
+        if a == b:
+            return 1.0
+        
+        # quick_ratio is a cheap upper bound; confirm with the exact ratio
+        matcher = difflib.SequenceMatcher(None, a, b)
+        if matcher.quick_ratio() >= 0.97:
+            ratio = matcher.ratio()
+            if ratio >= 0.97:
+                return ratio
+        
+        return None
+    
     def _calculate_semantic_similarity(self, text1: str, text2: str) -> float:
         """Calculate semantic similarity using sentence transformers"""
+        lexical = self._lexical_similarity(text1, text2)
+        if lexical is not None:
+            return lexical
+        
         try:
-            # Encode texts
-            embeddings = self.similarity_model.encode([text1, text2])
-            
-            # Calculate cosine similarity
-            similarity = np.dot(embeddings[0], embeddings[1]) / (
-                np.linalg.norm(embeddings[0]) * np.linalg.norm(embeddings[1])
-            )
-            
-            return float(similarity)
+            # Embeddings are pre-normalized, so cosine similarity is a dot product
+            return float(self._encode_cached(text1) @ self._encode_cached(text2))
             
         except Exception as e:
             logger.warning(f"Semantic similarity calculation failed: {e}")
@@ -474,49 +761,19 @@ class GradingAgent:
     
     def _extract_mcq_option(self, text: str) -> str:
         """Extract MCQ option letter from text"""
-        import re
+        text_lower = text.lower().strip()
         
-        # Look for patterns like: "a)", "A)", "(a)", "(A)", "a.", "A.", or standalone "a", "A"
-        patterns = [
-            r'\b([a-e])\)',
-            r'\(([a-e])\)',
-            r'\b([a-e])\.',
-            r'\b([a-e])\b'
-        ]
+        # Fast path: entire text is just a letter
+        if len(text_lower) == 1:
+            return text_lower if text_lower in 'abcde' else ""
         
-        text_lower = text.lower().strip()
-        for pattern in patterns:
-            match = re.search(pattern, text_lower)
+        for pattern in MCQ_OPTION_PATTERNS:
+            match = pattern.search(text_lower)
             if match:
                 return match.group(1)
         
-        # If no pattern found, check if entire text is just a letter
-        if len(text_lower) == 1 and text_lower in 'abcde':
-            return text_lower
-        
         return ""
     
     def _calculate_grade(self, percentage: float) -> str:
         """Convert percentage to letter grade"""
-        if percentage >= 90:
-            return "A+"
-        elif percentage >= 85:
-            return "A"
-        elif percentage >= 80:
-            return "A-"
-        elif percentage >= 75:
-            return "B+"
-        elif percentage >= 70:
-            return "B"
-        elif percentage >= 65:
-            return "B-"
-        elif percentage >= 60:
-            return "C+"
-        elif percentage >= 55:
-            return "C"
-        elif percentage >= 50:
-            return "C-"
-        elif percentage >= 45:
-            return "D"
-        else:
-            return "F"
+        return GRADE_LABELS[bisect.bisect_right(GRADE_CUTOFFS, percentage)]
@@ -1,11 +1,19 @@
+import anthropic
+import asyncio
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import numpy as np
 from PIL import Image
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 from loguru import logger
-import uuid
 
-from utils.image_tools import ImageProcessor
-from utils.vision_api import ClaudeVisionAPI
+from agents._shared import get_diagram_save_pool, get_image_processor, get_vision_api
+from utils.page_cache import PageCache
+from config.prompts import DIAGRAM_DETECTION_PROMPT
 from models.schemas import Diagram, BoundingBox
 from config.settings import settings
 
@@ -13,9 +21,34 @@ from config.settings import settings
 class ImageExtractorAgent:
     """Agent for extracting diagrams and figures from documents"""
     
+    # PNG zlib level for saved diagrams (1 = fastest encode)
+    PNG_COMPRESS_LEVEL = 1
+    
     def __init__(self):
-        self.image_processor = ImageProcessor()
-        self.vision_api = ClaudeVisionAPI()
+        self.image_processor = get_image_processor()
+        self.vision_api = get_vision_api()
+        
+        # Diagram IDs: 64-bit random per-run prefix (unique across runs sharing an output
+        # dir) plus a counter (unique across documents within a run)
+        self._run_id = os.urandom(8).hex()
+        self._diagram_counter = itertools.count()
+        
+        # Background writer so PNG encoding overlaps detection and cropping
+        self._io_pool = get_diagram_save_pool()
+        
+        # AI detections keyed by page bytes, so unchanged pages skip the API on reruns
+        self.detection_cache = None
+        if settings.enable_detection_cache:
+            self.detection_cache = PageCache(settings.temp_dir / "detection_cache")
+    
+    def _next_diagram_id(self, page_num: int, index: int) -> str:
+        """Unique diagram ID: page/index plus a per-run prefix and counter"""
+        return f"p{page_num}_d{index+1}_{self._run_id}{next(self._diagram_counter):04x}"
+    
+    def _save_async(self, image: Image.Image, path: str) -> Future:
+        """Queue an image for saving, returning its future"""
+        return self._io_pool.submit(image.save, path, optimize=False,
+                                    compress_level=self.PNG_COMPRESS_LEVEL)
     
     def extract_diagrams_from_pages(self, image_paths: List[str],
                                     output_dir: str = None) -> List[List[Diagram]]:
@@ -29,6 +62,29 @@ class ImageExtractorAgent:
         Returns:
             List of diagram lists (one list per page)
         """
+        all_diagrams = [[] for _ in image_paths]
+        for page_num, diagrams in self.extract_diagrams_iter(image_paths, output_dir):
+            all_diagrams[page_num - 1] = diagrams
+        
+        total_diagrams = sum(len(diagrams) for diagrams in all_diagrams)
+        
+        logger.success(f"Extracted {total_diagrams} diagrams total")
+        return all_diagrams
+    
+    def extract_diagrams_iter(self, image_paths: List[str],
+                              output_dir: str = None) -> Iterator[Tuple[int, List[Diagram]]]:
+        """
+        Extract diagrams from multiple pages, yielding each page as it finishes
+        
+        Lets callers consume pages while later pages are still being extracted.
+        
+        Args:
+            image_paths: List of page image paths
+            output_dir: Directory to save extracted diagrams
+            
+        Yields:
+            (page_num, diagrams) tuples, in completion order (page_num is 1-based)
+        """
         if output_dir is None:
             output_dir = str(settings.images_dir / "diagrams")
         
@@ -36,37 +92,165 @@ class ImageExtractorAgent:
         
         logger.info(f"Extracting diagrams from {len(image_paths)} pages")
         
-        all_diagrams = []
-        total_diagrams = 0
+        if settings.use_ai_diagram_detection:
+            yield from self._iter_pages_ai(image_paths, output_dir)
+            return
         
-        for page_num, path in enumerate(image_paths, 1):
-            logger.debug(f"Processing page {page_num}/{len(image_paths)}")
-            
-            image = Image.open(path)
-            
-            # Choose extraction method
-            if settings.use_ai_diagram_detection:
-                diagrams = self._extract_with_ai(image, page_num, output_dir)
-            else:
-                diagrams = self._extract_with_cv(image, page_num, output_dir)
-            
-            all_diagrams.append(diagrams)
-            total_diagrams += len(diagrams)
+        # Pages are independent; threads overlap OpenCV/PIL work (GIL released)
+        max_workers = self._get_max_workers(len(image_paths))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            page_nums = range(1, len(image_paths) + 1)
+            yield from zip(page_nums, executor.map(
+                self._process_page,
+                page_nums,
+                image_paths,
+                [output_dir] * len(image_paths)
+            ))
+    
+    def _iter_pages_ai(self, image_paths: List[str],
+                       output_dir: str) -> Iterator[Tuple[int, List[Diagram]]]:
+        """Run the async AI pipeline on a background thread, yielding pages as they finish"""
+        results = queue.Queue()
+        done = object()
+        
+        def run():
+            try:
+                asyncio.run(self._extract_pages_ai_async(
+                    image_paths, output_dir, lambda *page: results.put(page)
+                ))
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(done)
+        
+        thread = threading.Thread(target=run, name="diagram-extraction", daemon=True)
+        thread.start()
+        
+        while (item := results.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        
+        thread.join()
+    
+    def _get_max_workers(self, num_pages: int) -> int:
+        """Number of page workers for the CPU-bound crop/assess/save stage"""
+        cap = settings.max_page_workers or os.cpu_count() or 1
+        return max(1, min(cap, num_pages))
+    
+    async def _extract_pages_ai_async(self, image_paths: List[str], output_dir: str,
+                                      on_page: Optional[Callable[[int, List[Diagram]], None]] = None
+                                      ) -> List[List[Diagram]]:
+        """
+        Extract diagrams with AI detection, pipelining pages through each phase
+        
+        Each page is decoded, sent to Claude Vision and then cropped/assessed/saved
+        on its own, so while some pages wait on the API others are being encoded
+        or post-processed, instead of every page going through each phase in lockstep.
+        on_page(page_num, diagrams) is called as each page finishes.
+        """
+        semaphore = asyncio.Semaphore(settings.max_concurrent_api_calls)
+        loop = asyncio.get_running_loop()
+        
+        with ThreadPoolExecutor(max_workers=self._get_max_workers(len(image_paths))) as executor:
+            async def extract(page_num: int, path: str) -> List[Diagram]:
+                # Only pages with diagrams are decoded at full resolution
+                async with semaphore:
+                    detected = await self._detect_cached_async(path, executor, client)
+                
+                diagrams = []
+                if detected:
+                    logger.debug(f"Processing page {page_num}")
+                    image = await loop.run_in_executor(executor, self.image_processor.fast_open, path)
+                    diagrams = await loop.run_in_executor(
+                        executor, self._extract_with_ai, image, page_num, output_dir, detected
+                    )
+                
+                if diagrams:
+                    logger.info(f"Page {page_num}: extracted {len(diagrams)} diagrams")
+                
+                if on_page is not None:
+                    on_page(page_num, diagrams)
+                return diagrams
             
-            if diagrams:
-                logger.info(f"Page {page_num}: extracted {len(diagrams)} diagrams")
+            async with self.vision_api.async_client() as client:
+                return await asyncio.gather(*[
+                    extract(page_num, path) for page_num, path in enumerate(image_paths, 1)
+                ])
+    
+    async def _detect_cached_async(self, path: str, executor: ThreadPoolExecutor,
+                                   client: anthropic.AsyncAnthropic) -> List[Dict]:
+        """Detect diagrams on a page, reusing a cached result for identical page bytes"""
+        loop = asyncio.get_running_loop()
         
-        logger.success(f"Extracted {total_diagrams} diagrams total")
-        return all_diagrams
+        key = None
+        if self.detection_cache is not None:
+            key = await loop.run_in_executor(
+                executor, self.detection_cache.key, path,
+                settings.anthropic_model, DIAGRAM_DETECTION_PROMPT, str(settings.vision_max_image_size)
+            )
+            detected = self.detection_cache.get(key)
+            if detected is not None:
+                logger.debug(f"Detection cache hit for {path}")
+                return detected
+        
+        # The API only sees a downscaled page, so decode at reduced scale
+        preview = await loop.run_in_executor(
+            executor, self.image_processor.open_reduced, path, settings.vision_max_image_size
+        )
+        detected = await self.vision_api.detect_diagrams_async(client, preview)
+        
+        # Failed calls also return [], so only non-empty detections are cached
+        if key is not None and detected:
+            self.detection_cache.put(key, detected)
+        return detected
+    
+    def _wait_for_saves(self, pending_saves: List[Tuple[str, Future]]) -> Set[str]:
+        """Block until queued saves finish, returning paths that failed to save"""
+        wait([future for _, future in pending_saves])
+        
+        failed_paths = set()
+        for path, future in pending_saves:
+            if future.exception():
+                logger.warning(f"Failed to save diagram {path}: {future.exception()}")
+                failed_paths.add(path)
+        return failed_paths
+    
+    def _process_page(self, page_num: int, path: str, output_dir: str) -> List[Diagram]:
+        """Extract diagrams from a single page"""
+        logger.debug(f"Processing page {page_num}")
+        
+        image = self.image_processor.fast_open(path)
+        
+        # Choose extraction method
+        if settings.use_ai_diagram_detection:
+            diagrams = self._extract_with_ai(image, page_num, output_dir)
+        else:
+            diagrams = self._extract_with_cv(image, page_num, output_dir)
+        
+        if diagrams:
+            logger.info(f"Page {page_num}: extracted {len(diagrams)} diagrams")
+        
+        return diagrams
+    
+    def _keep_quality(self, qualities: np.ndarray, page_num: int) -> np.ndarray:
+        """Indices of diagrams meeting the quality threshold"""
+        keep = np.flatnonzero(qualities >= settings.image_quality_threshold)
+        if len(keep) < len(qualities):
+            logger.debug(f"Page {page_num}: skipping {len(qualities) - len(keep)} "
+                         f"low quality diagrams")
+        return keep
     
     def _extract_with_ai(self, image: Image.Image, page_num: int,
-                        output_dir: str) -> List[Diagram]:
+                        output_dir: str, detected: Optional[List[Dict]] = None) -> List[Diagram]:
         """Extract diagrams using Claude Vision AI"""
         try:
-            # Detect diagrams with AI
-            detected = self.vision_api.detect_diagrams(image)
+            # Detect diagrams with AI, unless already detected for this page
+            if detected is None:
+                detected = self.vision_api.detect_diagrams(image)
             
-            diagrams = []
+            # Parse and crop every detection first so quality is scored in one batch
+            parsed = []
             for i, det in enumerate(detected):
                 try:
                     # Parse bounding box
@@ -83,15 +267,27 @@ class ImageExtractorAgent:
                         image,
                         (bbox.x_min, bbox.y_min, bbox.x_max, bbox.y_max)
                     )
+                    parsed.append((i, det, bbox, cropped))
                     
-                    # Assess quality
-                    quality = self.image_processor.assess_image_quality(cropped)
-                    quality_score = min(quality / 100.0, 1.0)
-                    
+                except Exception as e:
+                    logger.warning(f"Failed to process diagram {i}: {e}")
+                    continue
+            
+            # Assess quality
+            qualities = np.array([self.image_processor.assess_image_quality(cropped)
+                                  for _, _, _, cropped in parsed], dtype=np.float64)
+            keep = self._keep_quality(qualities, page_num)
+            quality_scores = np.minimum(qualities[keep] / 100.0, 1.0).tolist()
+            
+            diagrams = []
+            pending_saves = []
+            for j, quality_score in zip(keep.tolist(), quality_scores):
+                i, det, bbox, cropped = parsed[j]
+                try:
                     # Save diagram
-                    diagram_id = f"p{page_num}_d{i+1}_{uuid.uuid4().hex[:8]}"
+                    diagram_id = self._next_diagram_id(page_num, i)
                     diagram_path = f"{output_dir}/{diagram_id}.png"
-                    cropped.save(diagram_path)
+                    pending_saves.append((diagram_path, self._save_async(cropped, diagram_path)))
                     
                     # Create Diagram object
                     diagram = Diagram(
@@ -110,7 +306,9 @@ class ImageExtractorAgent:
                     logger.warning(f"Failed to process diagram {i}: {e}")
                     continue
             
-            return diagrams
+            # Diagram paths must exist before the results are used
+            failed_paths = self._wait_for_saves(pending_saves)
+            return [d for d in diagrams if d.image_path not in failed_paths]
             
         except Exception as e:
             logger.error(f"AI diagram extraction failed: {e}")
@@ -121,44 +319,44 @@ class ImageExtractorAgent:
         """Extract diagrams using OpenCV (faster but less accurate)"""
         try:
             # Extract diagrams with OpenCV
-            extracted = self.image_processor.extract_diagram_cv(
+            crops, bboxes_px = self.image_processor.extract_diagram_cv(
                 image,
                 min_size=settings.min_diagram_size
             )
             
+            # Assess quality of every crop and drop low quality ones before any
+            # per-diagram work (bbox conversion, PNG encode)
+            qualities = np.array([self.image_processor.assess_image_quality(crop)
+                                  for crop in crops], dtype=np.float64)
+            keep = self._keep_quality(qualities, page_num)
+            quality_scores = np.minimum(qualities[keep] / 100.0, 1.0)
+            
+            # Convert kept pixel (x, y, w, h) boxes to percentage corners in one pass
+            img_width, img_height = image.size
+            scale = np.array([100 / img_width, 100 / img_height,
+                              100 / img_width, 100 / img_height], dtype=np.float64)
+            bboxes_pct = bboxes_px[keep].astype(np.float64) * scale
+            bboxes_pct[:, 2] += bboxes_pct[:, 0]
+            bboxes_pct[:, 3] += bboxes_pct[:, 1]
+            
             diagrams = []
-            for i, (diagram_cv, bbox_pixels) in enumerate(extracted):
+            pending_saves = []
+            for i, pct, quality_score in zip(keep.tolist(), bboxes_pct.tolist(),
+                                             quality_scores.tolist()):
+                diagram_pil = crops[i]
                 try:
-                    # Convert pixel bbox to percentage
-                    x, y, w, h = bbox_pixels
-                    img_width, img_height = image.size
-                    
-                    bbox = BoundingBox(
-                        x_min=(x / img_width) * 100,
-                        y_min=(y / img_height) * 100,
-                        x_max=((x + w) / img_width) * 100,
-                        y_max=((y + h) / img_height) * 100
+                    # Contour boxes lie within the page, so the 0-100 range holds
+                    bbox = BoundingBox.model_construct(
+                        x_min=pct[0], y_min=pct[1], x_max=pct[2], y_max=pct[3]
                     )
                     
-                    # Convert to PIL
-                    diagram_pil = self.image_processor.cv2_to_pil(diagram_cv)
-                    
-                    # Assess quality
-                    quality = self.image_processor.assess_image_quality(diagram_pil)
-                    quality_score = min(quality / 100.0, 1.0)
-                    
-                    # Skip low quality
-                    if quality < settings.image_quality_threshold:
-                        logger.debug(f"Skipping low quality diagram (score: {quality:.2f})")
-                        continue
-                    
                     # Save diagram
-                    diagram_id = f"p{page_num}_d{i+1}_{uuid.uuid4().hex[:8]}"
+                    diagram_id = self._next_diagram_id(page_num, i)
                     diagram_path = f"{output_dir}/{diagram_id}.png"
-                    diagram_pil.save(diagram_path)
+                    pending_saves.append((diagram_path, self._save_async(diagram_pil, diagram_path)))
                     
-                    # Create Diagram object
-                    diagram = Diagram(
+                    # Create Diagram object (all values computed here, so skip validation)
+                    diagram = Diagram.model_construct(
                         diagram_id=diagram_id,
                         type='detected',  # Type unknown with CV method
                         description='Automatically detected diagram',
@@ -174,7 +372,9 @@ class ImageExtractorAgent:
                     logger.warning(f"Failed to process diagram {i}: {e}")
                     continue
             
-            return diagrams
+            # Diagram paths must exist before the results are used
+            failed_paths = self._wait_for_saves(pending_saves)
+            return [d for d in diagrams if d.image_path not in failed_paths]
             
         except Exception as e:
             logger.error(f"OpenCV diagram extraction failed: {e}")
@@ -1,17 +1,45 @@
-import json
+import functools
+import os
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Type, TypeVar
 from datetime import datetime
 from loguru import logger
+from pydantic import BaseModel
+from pydantic_core import from_json
 
 from models.schemas import (QuestionPaperJSON, SolutionPaperJSON, AnswerSheetJSON,
-                            ExamMetadata, Question, Answer, ProcessingMetrics)
+                            ExamMetadata, Question, Answer, ProcessingMetrics, GradingReport)
 from config.settings import settings
 
 
+ModelT = TypeVar('ModelT', bound=BaseModel)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_model(json_path: str, mtime_ns: int, size: int, model: Type[ModelT]) -> ModelT:
+    """Parse and validate a JSON file (cached by load_model while the file is unchanged)"""
+    return model.model_validate_json(Path(json_path).read_bytes())
+
+
 class JSONGeneratorAgent:
     """Agent for generating structured JSON outputs"""
     
+    def _write_json(self, model: BaseModel, output_path: Path):
+        """
+        Serialize a model with pydantic's native encoder and write it atomically
+        
+        The JSON is written to a temporary file in the same directory and renamed
+        over the target, so a crash never leaves a truncated output behind.
+        """
+        tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(model.model_dump_json(indent=2).encode('utf-8'))
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    
     def generate_question_paper_json(self, metadata: ExamMetadata,
                                     questions: List[Question],
                                     processing_time: float,
@@ -40,8 +68,7 @@ class JSONGeneratorAgent:
         
         # Save to file
         output_path = settings.output_dir / output_filename
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(question_paper.model_dump(), f, indent=2, default=str)
+        self._write_json(question_paper, output_path)
         
         logger.success(f"Question paper JSON saved to: {output_path}")
         return str(output_path)
@@ -74,8 +101,7 @@ class JSONGeneratorAgent:
         
         # Save to file
         output_path = settings.output_dir / output_filename
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(solution_paper.model_dump(), f, indent=2, default=str)
+        self._write_json(solution_paper, output_path)
         
         logger.success(f"Solution paper JSON saved to: {output_path}")
         return str(output_path)
@@ -112,12 +138,27 @@ class JSONGeneratorAgent:
         # Save to file
         output_filename = f"answer_sheet_{student_id}.json"
         output_path = settings.output_dir / output_filename
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(answer_sheet.model_dump(), f, indent=2, default=str)
+        self._write_json(answer_sheet, output_path)
         
         logger.success(f"Answer sheet JSON saved to: {output_path}")
         return str(output_path)
     
+    def generate_grading_report_json(self, report: GradingReport,
+                                     output_filename: str) -> str:
+        """
+        Save a grading report as JSON
+        
+        Args:
+            report: Grading report
+            output_filename: Output filename
+            
+        Returns:
+            Path to saved JSON file
+        """
+        output_path = settings.output_dir / output_filename
+        self._write_json(report, output_path)
+        return str(output_path)
+    
     def load_json(self, json_path: str) -> Dict[str, Any]:
         """
         Load JSON file
@@ -129,14 +170,37 @@ class JSONGeneratorAgent:
             Parsed JSON as dictionary
         """
         try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = from_json(Path(json_path).read_bytes())
             logger.debug(f"Loaded JSON from: {json_path}")
             return data
         except Exception as e:
             logger.error(f"Failed to load JSON from {json_path}: {e}")
             raise
     
+    def load_model(self, json_path: str, model: Type[ModelT]) -> ModelT:
+        """
+        Load a generated JSON file straight into its schema model
+        
+        Parsing and validation happen in one pass in pydantic-core, without an
+        intermediate dict. Repeat loads of an unchanged file (same mtime and
+        size) return the cached model, so callers must not mutate it.
+        
+        Args:
+            json_path: Path to JSON file
+            model: Schema class, e.g. QuestionPaperJSON or AnswerSheetJSON
+            
+        Returns:
+            Validated model instance
+        """
+        try:
+            stat = os.stat(json_path)
+            data = _load_model(str(json_path), stat.st_mtime_ns, stat.st_size, model)
+            logger.debug(f"Loaded {model.__name__} from: {json_path}")
+            return data
+        except Exception as e:
+            logger.error(f"Failed to load {model.__name__} from {json_path}: {e}")
+            raise
+    
     def generate_processing_metrics(self, total_pages: int,
                                    diagrams_extracted: int,
                                    avg_ocr_confidence: float,
@@ -173,8 +237,7 @@ class JSONGeneratorAgent:
         
         # Save to file
         output_path = settings.output_dir / output_filename
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(metrics.model_dump(), f, indent=2, default=str)
+        self._write_json(metrics, output_path)
         
         logger.info(f"Processing metrics saved to: {output_path}")
         return str(output_path)
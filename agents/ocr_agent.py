@@ -1,11 +1,16 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import Image
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from loguru import logger
 from tqdm import tqdm
 
-from utils.ocr_tools import OCREngine
-from utils.vision_api import ClaudeVisionAPI
+from utils.page_cache import PageCache
+from agents._shared import get_image_processor, get_ocr_engine, get_vision_api
 from models.schemas import OCRResult
+from config.prompts import HANDWRITING_OCR_PROMPT
 from config.settings import settings
 
 
@@ -13,29 +18,147 @@ class OCRAgent:
     """Agent for intelligent multi-engine OCR"""
     
     def __init__(self):
-        self.ocr_engine = OCREngine()
-        self.vision_api = ClaudeVisionAPI()
+        self.ocr_engine = get_ocr_engine()
+        self.vision_api = get_vision_api()
+        self.image_processor = get_image_processor()
+        
+        # Recently decoded pages, keyed by (path, mtime) so edited files are re-read
+        self._image_cache = functools.lru_cache(maxsize=8)(self._open_image)
+        
+        # Final OCR results across runs, keyed by page content and OCR setup
+        self.ocr_cache = None
+        if settings.enable_ocr_cache:
+            self.ocr_cache = PageCache(settings.temp_dir / "ocr_cache")
+    
+    def _open_image(self, image_path: str, mtime: float) -> Image.Image:
+        """Decode an image file (cached by _load_image; callers must not mutate it)"""
+        return self.image_processor.fast_open(image_path)
+    
+    def _load_image(self, image_path: str) -> Image.Image:
+        """Get a decoded page, reusing a cached decode when the file is unchanged"""
+        return self._image_cache(str(image_path), os.path.getmtime(image_path))
+    
+    def _cached_ocr(self, image_path: str, is_handwritten: bool,
+                    vision_fallback: bool = True) -> Tuple[Optional[str], Optional[OCRResult]]:
+        """
+        Look up a page's OCR result in the cache
+        
+        Returns:
+            (cache key, cached OCRResult or None); the key is None when caching is off
+        """
+        if self.ocr_cache is None:
+            return None, None
+        
+        key = self.ocr_cache.key(
+            image_path, str(is_handwritten), str(vision_fallback), settings.anthropic_model, HANDWRITING_OCR_PROMPT,
+            str(settings.vision_max_image_size), str(settings.use_multi_ocr),
+            str(settings.ocr_confidence_threshold), str(settings.min_text_chars),
+            str(settings.handwriting_detection_threshold)
+        )
+        cached = self.ocr_cache.get(key)
+        if cached is None:
+            return key, None
+        
+        logger.debug(f"OCR cache hit for {image_path}")
+        return key, OCRResult(**cached)
+    
+    def _store_ocr(self, key: Optional[str], result: OCRResult):
+        """Cache a final OCR result (failed pages are left to be retried)"""
+        if key is not None and result.engine != "error":
+            self.ocr_cache.put(key, result.model_dump(mode='json'))
+    
+    @staticmethod
+    def _error_result(is_handwritten: bool) -> OCRResult:
+        """Empty result for a failed page (constant values, so validation is skipped)"""
+        return OCRResult.model_construct(
+            text="",
+            confidence=0.0,
+            engine="error",
+            has_handwriting=is_handwritten,
+            has_math=False,
+            quality="poor"
+        )
     
     def process_images(self, image_paths: List[str], 
-                      is_handwritten: bool = False) -> List[OCRResult]:
+                      is_handwritten: bool = False,
+                      vision_fallback: bool = True) -> List[OCRResult]:
         """
         Batch OCR processing with intelligent fallback
         
         Args:
             image_paths: List of image file paths
             is_handwritten: Whether images contain handwriting
+            vision_fallback: Re-OCR low-confidence pages with Claude Vision (callers
+                             with their own escalation tier can turn this off)
             
         Returns:
             List of OCRResult objects
         """
         logger.info(f"Processing {len(image_paths)} images with OCR")
         
-        results = []
-        for i, path in enumerate(tqdm(image_paths, desc="OCR Processing"), 1):
-            result = self.process_single_image(path, is_handwritten)
-            results.append(result)
-            
-            if settings.verbose:
+        try:
+            return self._process_images(image_paths, is_handwritten, vision_fallback)
+        finally:
+            # The agent outlives the call; don't pin full-resolution pages in memory
+            self._image_cache.cache_clear()
+    
+    def _process_images(self, image_paths: List[str], is_handwritten: bool,
+                        vision_fallback: bool) -> List[OCRResult]:
+        """OCR a batch of pages: cached results, local OCR, then Vision fallback"""
+        # Pages OCR'd in an earlier run are reused as-is
+        results: List[OCRResult] = [None] * len(image_paths)
+        keys: List[Optional[str]] = [None] * len(image_paths)
+        pending = []
+        for i, path in enumerate(image_paths):
+            keys[i], results[i] = self._cached_ocr(str(path), is_handwritten, vision_fallback)
+            if results[i] is None:
+                pending.append(i)
+        
+        if len(pending) < len(image_paths):
+            logger.info(f"Reusing cached OCR for {len(image_paths) - len(pending)} pages")
+        
+        # Handwritten pages go through EasyOCR's detector in batches
+        primaries = {}
+        if is_handwritten and self.ocr_engine.reader is not None and len(pending) > 1:
+            primaries = self._handwritten_batches(image_paths, pending)
+        
+        # Local OCR first, in parallel (Tesseract/EasyOCR release the GIL)
+        max_workers = max(1, min(settings.ocr_workers, len(pending)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._local_ocr, image_paths[i], is_handwritten, primaries.get(i)): i
+                for i in pending
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="OCR Processing"):
+                results[futures[future]] = future.result()
+        
+        # Collect pages that need Claude Vision
+        vision_pages = [
+            i for i in pending
+            if vision_fallback and results[i].engine != "error" and self.ocr_engine.needs_claude_vision(results[i])
+        ]
+        vision_failed = set()
+        
+        # Issue all Claude Vision fallbacks concurrently
+        if vision_pages:
+            logger.info(f"Using Claude Vision for improved OCR on {len(vision_pages)} pages")
+            vision_results = asyncio.run(self._vision_ocr_async(
+                [image_paths[i] for i in vision_pages], is_handwritten
+            ))
+            for i, vision_result in zip(vision_pages, vision_results):
+                # Use Vision result if it's likely better
+                if vision_result.confidence > 0:
+                    results[i] = vision_result
+                else:
+                    vision_failed.add(i)
+        
+        # Pages whose Vision fallback failed are not cached, so a later run retries them
+        for i in pending:
+            if i not in vision_failed:
+                self._store_ocr(keys[i], results[i])
+        
+        if settings.verbose:
+            for i, result in enumerate(results, 1):
                 logger.debug(f"Page {i}: confidence={result.confidence:.2f}, "
                            f"engine={result.engine}, quality={result.quality}")
         
@@ -44,6 +167,50 @@ class OCRAgent:
         
         return results
     
+    def _local_ocr(self, image_path: str, is_handwritten: bool,
+                   primary: Optional[OCRResult] = None) -> OCRResult:
+        """Run local OCR engines only, reusing a precomputed first-choice result"""
+        try:
+            image = self._load_image(image_path)
+            return self.ocr_engine.intelligent_ocr(image, is_handwritten, primary)
+        except Exception as e:
+            logger.error(f"OCR failed for {image_path}: {e}")
+            return self._error_result(is_handwritten)
+    
+    def _handwritten_batches(self, image_paths: List[str], indices: List[int]) -> Dict[int, OCRResult]:
+        """
+        EasyOCR results for handwritten pages, ocr_batch_size pages per call
+        
+        Pages that fail to load are left out and go through _local_ocr as usual.
+        """
+        primaries = {}
+        batch_size = max(1, settings.ocr_batch_size)
+        for start in range(0, len(indices), batch_size):
+            batch, images = [], []
+            for i in indices[start:start + batch_size]:
+                try:
+                    images.append(self._load_image(image_paths[i]))
+                    batch.append(i)
+                except Exception as e:
+                    logger.error(f"OCR failed for {image_paths[i]}: {e}")
+            
+            primaries.update(zip(batch, self.ocr_engine.ocr_handwritten_batch(images)))
+        
+        return primaries
+    
+    async def _vision_ocr_async(self, image_paths: List[str],
+                                is_handwritten: bool) -> List[OCRResult]:
+        """OCR pages with concurrent Claude Vision calls"""
+        semaphore = asyncio.Semaphore(settings.max_concurrent_api_calls)
+        
+        async with self.vision_api.async_client() as client:
+            async def ocr(path: str) -> OCRResult:
+                async with semaphore:
+                    image = self._load_image(path)
+                    return await self.vision_api.ocr_with_vision_async(client, image, is_handwritten)
+            
+            return await asyncio.gather(*[ocr(path) for path in image_paths])
+    
     def process_single_image(self, image_path: str, 
                             is_handwritten: bool = False) -> OCRResult:
         """
@@ -57,7 +224,11 @@ class OCRAgent:
             OCRResult object
         """
         try:
-            image = Image.open(image_path)
+            key, cached = self._cached_ocr(str(image_path), is_handwritten)
+            if cached is not None:
+                return cached
+            
+            image = self._load_image(image_path)
             
             # Try local OCR first
             result = self.ocr_engine.intelligent_ocr(image, is_handwritten)
@@ -69,20 +240,16 @@ class OCRAgent:
                 
                 # Use Vision result if it's likely better
                 if vision_result.confidence > 0:
+                    self._store_ocr(key, vision_result)
                     return vision_result
+                return result
             
+            self._store_ocr(key, result)
             return result
             
         except Exception as e:
             logger.error(f"OCR failed for {image_path}: {e}")
-            return OCRResult(
-                text="",
-                confidence=0.0,
-                engine="error",
-                has_handwriting=is_handwritten,
-                has_math=False,
-                quality="poor"
-            )
+            return self._error_result(is_handwritten)
     
     def extract_from_specific_region(self, image_path: str, 
                                      bbox: tuple,
@@ -98,14 +265,11 @@ class OCRAgent:
         Returns:
             OCRResult object
         """
-        from utils.image_tools import ImageProcessor
-        
         try:
-            image = Image.open(image_path)
-            processor = ImageProcessor()
+            image = self._load_image(image_path)
             
-            # Crop to region
-            cropped = processor.crop_region(image, bbox)
+            # Crop to region (a new image, the cached page is left untouched)
+            cropped = self.image_processor.crop_region(image, bbox)
             
             # Process cropped region
             result = self.ocr_engine.intelligent_ocr(cropped, is_handwritten)
@@ -118,11 +282,4 @@ class OCRAgent:
             
         except Exception as e:
             logger.error(f"Region extraction failed: {e}")
-            return OCRResult(
-                text="",
-                confidence=0.0,
-                engine="error",
-                has_handwriting=is_handwritten,
-                has_math=False,
-                quality="poor"
-            )
+            return self._error_result(is_handwritten)
@@ -1,22 +1,143 @@
+import bisect
+import functools
 import re
-from typing import List, Dict, Optional
+from itertools import chain, islice
+from typing import List, Dict, Optional, Tuple
 from loguru import logger
 
 from models.schemas import (Question, Answer, ExamMetadata, QuestionType, 
                             OCRResult, Diagram)
 
 
+# Patterns marked "lowercased" are case-sensitive and run on _lowered(text);
+# without re.IGNORECASE the engine can use its fast literal/charset prefix scan
+
+# Metadata patterns
+COURSE_CODE_PATTERN = re.compile(r'([a-z]{2,4}[-\s]?\d{3,4})')  # lowercased
+TITLE_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'(.*?exam.*?)\n',
+    r'(.*?test.*?)\n',
+    r'(.*?quiz.*?)\n',
+    r'(.*?assignment.*?)\n'
+))
+DATE_PATTERNS = tuple(re.compile(p) for p in (
+    r'\b(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\b',
+    r'\b([A-Z][a-z]+\s+\d{1,2},?\s+\d{4})\b',
+    r'\b(\d{4}[-/]\d{1,2}[-/]\d{1,2})\b'
+))
+# Total marks and duration share one full-text scan (their matches cannot overlap); lowercased
+MARKS_DURATION_PATTERN = re.compile(
+    r'total\s*marks?\s*:?\s*(?P<total_marks>\d+)'
+    r'|duration\s*:?\s*(?P<duration>\d+\s*(?:hours?|mins?|minutes?))'
+)
+
+# Question segmentation patterns
+MARKS_INDICATOR_PATTERN = re.compile(r'\((\d+)\s*Marks?\)', re.IGNORECASE)
+SUBPART_PATTERN = re.compile(r'^\s*\(([a-z])\)')
+QUESTION_NUMBER_PATTERN = re.compile(r'(?:^|\n)\s*(\d+)\.\s+')
+TOPIC_SHIFT_PATTERN = re.compile(r'(Show that|Prove that|Consider|Calculate|Find the)', re.IGNORECASE)
+# Legacy fallback: question anchors, and where a question's body ends
+LEGACY_QUESTION_ANCHOR = re.compile(
+    r'(?:^|\n)\s*(?:Q\.?\s*)?(\d+)([a-z]|\([a-z]\))?\s*[.)]\s*', re.IGNORECASE
+)
+LEGACY_QUESTION_END = re.compile(r'\n\s*(?:Q\.?\s*)?\d+[a-z]?[.)]', re.IGNORECASE)
+
+# Question content patterns
+MCQ_INDICATOR_PATTERN = re.compile(r'\b[a-e]\)')  # lowercased
+MCQ_OPTIONS_PATTERN = re.compile(r'([a-e])\)\s*([^\n]+?)(?=\s*[a-e]\)|\Z)', re.IGNORECASE)
+
+# Question type keywords, highest priority first
+QUESTION_TYPE_KEYWORDS = (
+    (QuestionType.MCQ, ('choose', 'select')),
+    (QuestionType.DERIVATION, ('derive', 'proof', 'prove', 'show that')),
+    (QuestionType.DIAGRAM, ('draw', 'sketch', 'diagram', 'plot', 'graph')),
+    (QuestionType.CODE, ('code', 'program', 'implement', 'algorithm')),
+    (QuestionType.NUMERICAL, ('calculate', 'compute', 'find', 'determine')),
+    (QuestionType.ESSAY, ('explain', 'discuss', 'describe', 'compare')),
+)
+QUESTION_TYPE_PRIORITY = {qt.name: i for i, (qt, _) in enumerate(QUESTION_TYPE_KEYWORDS)}
+# All keywords in one scan; one named group per type, inside a lookahead so
+# every occurrence is reported even where keywords overlap; lowercased
+QUESTION_TYPE_KEYWORD_PATTERN = re.compile(
+    '(?=' + '|'.join(f"(?P<{qt.name}>{'|'.join(map(re.escape, words))})"
+                     for qt, words in QUESTION_TYPE_KEYWORDS) + ')'
+)
+MARKS_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'\[(\d+)\s*(?:marks?|m)\]',
+    r'\((\d+)\s*(?:marks?|m)\)',
+    r'(\d+)\s*marks?',
+))
+
+# Answer sheet patterns
+FINAL_ANSWER_PATTERN = re.compile(r'(?:final\s+)?answer\s*:?\s*(.+?)(?:\n|$)', re.IGNORECASE)
+NAME_PATTERNS = tuple(re.compile(p) for p in (  # lowercased
+    r'name\s*:?\s*([a-z][a-z]+(?:\s+[a-z][a-z]+)+)',
+    r'student\s+name\s*:?\s*([a-z][a-z]+(?:\s+[a-z][a-z]+)+)',
+))
+ID_PATTERNS = tuple(re.compile(p) for p in (  # lowercased
+    r'(?:student\s+)?id\s*:?\s*([a-z0-9]+)',
+    r'roll\s+(?:no|number)\s*:?\s*([a-z0-9]+)',
+))
+EMAIL_PATTERN = re.compile(r'[\w\.-]+@[\w\.-]+\.\w+')
+
+# Answer start markers, found in one pass: "Q1", "Solution 1:", "1." / "7_" etc.
+ANSWER_MARKER_PATTERN = re.compile(
+    r'(?:^|\n)\s*(?:Q\.?\s*(?P<q>\d+)\s*[:.)]?'
+    r'|Solution\s+(?P<s>\d+)\s*:'
+    r'|(?P<n>\d+)\s*[_:.)\-])',
+    re.IGNORECASE
+)
+# Where an answer ends: the next "Q"/"Solution" label, or the next bare number marker
+LABELLED_ANSWER_END_PATTERN = re.compile(r'\n\s*(?:Q|Solution)\s*\.?\s*\d+', re.IGNORECASE)
+NUMBERED_ANSWER_END_PATTERN = re.compile(r'\n\s*\d+\s*[_:.)\-]')
+
+
+# Characters re.IGNORECASE matches to an ASCII letter that str.lower() does not
+# map to it (U+0130 would also lowercase to two characters and shift positions)
+_IGNORECASE_FOLDS = {0x130: 'i', 0x131: 'i', 0x17F: 's'}
+
+
+def _lowered(text: str) -> str:
+    """Lowercase text for the lowercased patterns, keeping every character's position"""
+    if not text.isascii():
+        text = text.translate(_IGNORECASE_FOLDS)
+    return text.lower()
+
+
+@functools.lru_cache(maxsize=512)
+def _answer_patterns(q_num: str) -> Tuple[re.Pattern, ...]:
+    """Compiled answer-locating patterns for a question number, most specific first"""
+    num = re.escape(q_num)
+    patterns = (
+        # Pattern 1: "Q1", "Q2", etc.
+        rf'(?:^|\n)\s*Q\.?\s*{num}\s*[:.)]?\s*(.*?)(?=(?:\n\s*(?:Q|Solution)\s*\.?\s*\d+|\Z))',
+        # Pattern 2: "Solution 1:", "Solution 2:", etc.
+        rf'(?:^|\n)\s*Solution\s+{num}\s*:\s*(.*?)(?=(?:\n\s*(?:Q|Solution)\s*\.?\s*\d+|\Z))',
+        # Pattern 3: Just the number with markers "1.", "2.", "7_", etc.
+        rf'(?:^|\n)\s*{num}\s*[_:.)\-]\s*(.*?)(?=(?:\n\s*\d+\s*[_:.)\-]|\Z))',
+        # Pattern 4: Relaxed pattern for any format
+        rf'(?:^|\n).*?{num}.*?[:.)]?\s*(.*?)(?=(?:\n\s*(?:Q|Solution)?\s*\.?\s*\d+[_:.)\-]|\Z))',
+    )
+    return tuple(re.compile(p, re.IGNORECASE | re.DOTALL) for p in patterns)
+
+
 class StructureAnalyzerAgent:
     """Agent for analyzing document structure and extracting questions/answers"""
     
+    # Characters of question text scanned for type keywords
+    CLASSIFY_SCAN_CHARS = 4096
+    
     def analyze_question_paper(self, ocr_results: List[OCRResult],
-                               diagrams_by_page: List[List[Diagram]]) -> tuple:
+                               diagrams_by_page: List[List[Diagram]],
+                               metadata: Optional[ExamMetadata] = None) -> tuple:
         """
         Analyze question paper structure
         
         Args:
             ocr_results: OCR results for each page
             diagrams_by_page: Diagrams extracted from each page
+            metadata: Optional pre-filled metadata (e.g. course code from the
+                      filename); fields already set are kept and not searched for
             
         Returns:
             (ExamMetadata, List[Question])
@@ -24,13 +145,13 @@ class StructureAnalyzerAgent:
         logger.info("Analyzing question paper structure")
         
         # Combine all text
-        full_text = "\n\n".join([r.text for r in ocr_results])
+        full_text, page_offsets = self._join_pages(ocr_results)
         
         # Extract metadata
-        metadata = self._extract_metadata(full_text)
+        metadata = self._extract_metadata(full_text, metadata)
         
         # Parse questions
-        questions = self._parse_questions(full_text, diagrams_by_page)
+        questions = self._parse_questions(full_text, diagrams_by_page, page_offsets)
         
         logger.success(f"Found {len(questions)} questions")
         return metadata, questions
@@ -55,71 +176,114 @@ class StructureAnalyzerAgent:
         student_info = self._extract_student_info(ocr_results[0].text if ocr_results else "")
         
         # Combine all text
-        full_text = "\n\n".join([r.text for r in ocr_results])
+        full_text, page_offsets = self._join_pages(ocr_results)
         
         # Parse answers
-        answers = self._parse_answers(full_text, diagrams_by_page, question_numbers, ocr_results)
+        answers = self._parse_answers(full_text, diagrams_by_page, question_numbers,
+                                      ocr_results, page_offsets)
         
         logger.success(f"Found {len(answers)} answers for student {student_info.get('name', 'Unknown')}")
         return student_info, answers
     
-    def _extract_metadata(self, text: str) -> ExamMetadata:
-        """Extract exam metadata from text"""
-        metadata = ExamMetadata()
+    @staticmethod
+    def _join_pages(ocr_results: List[OCRResult]) -> Tuple[str, List[int]]:
+        """
+        Join page texts into one document
+        
+        Returns:
+            (joined text, start offset of each page in the joined text)
+        """
+        page_offsets = []
+        pos = 0
+        for r in ocr_results:
+            page_offsets.append(pos)
+            pos += len(r.text) + 2
+        return "\n\n".join(r.text for r in ocr_results), page_offsets
+    
+    @staticmethod
+    def _diagrams_for_span(diagrams_by_page: List[List[Diagram]], page_offsets: List[int],
+                           start: int, end: int, high_only: bool = False) -> List[Diagram]:
+        """
+        Up to two diagrams from the pages a span of the joined text covers
+        
+        Args:
+            diagrams_by_page: Diagrams extracted from each page
+            page_offsets: Page start offsets from _join_pages
+            start: Span start in the joined text
+            end: Span end in the joined text
+            high_only: Only take high relevance diagrams
+            
+        Returns:
+            List of at most two diagrams
+        """
+        first_page = max(bisect.bisect_right(page_offsets, start) - 1, 0)
+        last_page = bisect.bisect_right(page_offsets, max(start, end - 1)) - 1
+        
+        candidates = chain.from_iterable(islice(diagrams_by_page, first_page, last_page + 1))
+        if high_only:
+            candidates = (d for d in candidates if d.relevance == "high")
+        return list(islice(candidates, 2))
+    
+    def _extract_metadata(self, text: str,
+                          metadata: Optional[ExamMetadata] = None) -> ExamMetadata:
+        """Extract exam metadata from text, only searching for fields not already set"""
+        if metadata is None:
+            metadata = ExamMetadata()
+        
+        # Total marks / duration still missing (both come from one scan)
+        wanted = {name for name in ('total_marks', 'duration')
+                  if getattr(metadata, name) is None}
+        
+        # Match on lowercased text, then slice the original to keep its case
+        if metadata.course_code is None or wanted:
+            lowered = _lowered(text)
         
         # Extract course code (e.g., EE-207, CS-101)
-        course_match = re.search(r'([A-Z]{2,4}[-\s]?\d{3,4})', text, re.IGNORECASE)
-        if course_match:
-            metadata.course_code = course_match.group(1)
+        if metadata.course_code is None:
+            course_match = COURSE_CODE_PATTERN.search(lowered)
+            if course_match:
+                metadata.course_code = text[course_match.start(1):course_match.end(1)]
         
         # Extract exam title
-        title_patterns = [
-            r'(.*?exam.*?)\n',
-            r'(.*?test.*?)\n',
-            r'(.*?quiz.*?)\n',
-            r'(.*?assignment.*?)\n'
-        ]
-        for pattern in title_patterns:
-            title_match = re.search(pattern, text[:500], re.IGNORECASE)
-            if title_match:
-                metadata.exam_title = title_match.group(1).strip()
-                break
+        if metadata.exam_title is None:
+            for pattern in TITLE_PATTERNS:
+                title_match = pattern.search(text, 0, 500)
+                if title_match:
+                    metadata.exam_title = title_match.group(1).strip()
+                    break
         
         # Extract date
-        date_patterns = [
-            r'\b(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\b',
-            r'\b([A-Z][a-z]+\s+\d{1,2},?\s+\d{4})\b',
-            r'\b(\d{4}[-/]\d{1,2}[-/]\d{1,2})\b'
-        ]
-        for pattern in date_patterns:
-            date_match = re.search(pattern, text[:500])
-            if date_match:
-                metadata.date = date_match.group(1)
-                break
+        if metadata.date is None:
+            for pattern in DATE_PATTERNS:
+                date_match = pattern.search(text, 0, 500)
+                if date_match:
+                    metadata.date = date_match.group(1)
+                    break
         
-        # Extract total marks
-        marks_match = re.search(r'total\s*marks?\s*:?\s*(\d+)', text, re.IGNORECASE)
-        if marks_match:
-            metadata.total_marks = float(marks_match.group(1))
+        # Extract total marks and duration (first occurrence of each)
+        found = {}
+        if wanted:
+            for match in MARKS_DURATION_PATTERN.finditer(lowered):
+                if match.lastgroup in wanted:
+                    found.setdefault(match.lastgroup, text[match.start(match.lastgroup):match.end(match.lastgroup)])
+                    if len(found) == len(wanted):
+                        break
         
-        # Extract duration
-        duration_match = re.search(r'duration\s*:?\s*(\d+\s*(?:hours?|mins?|minutes?))', text, re.IGNORECASE)
-        if duration_match:
-            metadata.duration = duration_match.group(1)
+        if 'total_marks' in found:
+            metadata.total_marks = float(found['total_marks'])
+        if 'duration' in found:
+            metadata.duration = found['duration']
         
         return metadata
     
     def _parse_questions(self, text: str, 
-                        diagrams_by_page: List[List[Diagram]]) -> List[Question]:
+                        diagrams_by_page: List[List[Diagram]],
+                        page_offsets: List[int]) -> List[Question]:
         """Parse questions from text - handles multi-part questions properly"""
         questions = []
         
-        # Flatten diagrams
-        all_diagrams = [d for page_diagrams in diagrams_by_page for d in page_diagrams]
-        
         # Find all marks indicators
-        marks_pattern = r'\((\d+)\s*Marks?\)'
-        marks_matches = list(re.finditer(marks_pattern, text, re.IGNORECASE))
+        marks_matches = list(MARKS_INDICATOR_PATTERN.finditer(text))
         
         if not marks_matches:
             logger.warning("No marks indicators found")
@@ -127,19 +291,31 @@ class StructureAnalyzerAgent:
         
         logger.info(f"Found {len(marks_matches)} marks indicators")
         
-        # Build text segments with marks
-        segments = []
+        # Build text segments with marks, as parallel per-segment lists
+        # (structural flags are computed once here, the grouping loop only reads them)
+        n = len(marks_matches)
+        seg_texts = [None] * n
+        seg_starts = [0] * n
+        seg_ends = [0] * n
+        seg_marks = [0.0] * n
+        seg_is_subpart = [False] * n
+        seg_is_first_subpart = [False] * n
+        seg_numbers = [None] * n
+        
+        prev_end = 0
         for i, m in enumerate(marks_matches):
-            marks_val = float(m.group(1))
-            start_pos = 0 if i == 0 else marks_matches[i-1].end()
-            end_pos = m.end()
-            segment_text = text[start_pos:end_pos].strip()
+            segment_text = text[prev_end:m.end()].strip()
+            subpart_match = SUBPART_PATTERN.search(segment_text)
+            number_match = QUESTION_NUMBER_PATTERN.search(segment_text)
             
-            segments.append({
-                'text': segment_text,
-                'marks': marks_val,
-                'is_subpart': re.search(r'^\s*\(([a-z])\)', segment_text) is not None
-            })
+            seg_texts[i] = segment_text
+            seg_starts[i] = prev_end
+            seg_ends[i] = m.end()
+            seg_marks[i] = float(m.group(1))
+            seg_is_subpart[i] = subpart_match is not None
+            seg_is_first_subpart[i] = subpart_match is not None and subpart_match.group(1) == 'a'
+            seg_numbers[i] = int(number_match.group(1)) if number_match else None
+            prev_end = m.end()
         
         # Intelligently group segments into questions
         # Rules:
@@ -148,87 +324,44 @@ class StructureAnalyzerAgent:
         # 3. High marks (>=3) after subparts -> likely new question
         # 4. Content-based: certain keywords suggest new question
         
-        question_groups = []
-        current_group = None
+        # One pass finds the segments that start a new question; only the two
+        # stateful flags (current question has subparts, previous was a subpart)
+        # are carried between iterations
+        splits = []
+        has_subparts = False
         last_was_subpart = False
         
-        for i, seg in enumerate(segments):
-            text = seg['text']
-            marks = seg['marks']
-            is_subpart = seg['is_subpart']
-            has_number = bool(re.search(r'(?:^|\n)\s*(\d+)\.\s+', text))
+        for i in range(n):
+            is_subpart = seg_is_subpart[i]
             
-            # Determine if this should start a new question
-            start_new = False
-            
-            if has_number:
-                # Explicit number -> new question
+            if not splits or seg_numbers[i] is not None:
+                # First segment, or explicit number -> new question
                 start_new = True
-            
             elif is_subpart:
-                # Check if this is (a) after the previous question ended
-                # If previous group had subparts, and this is (a), it's a new question
-                if re.search(r'^\s*\(a\)', text):
-                    if current_group and current_group['has_subparts']:
-                        start_new = True
-                    else:
-                        # First subpart of new question
-                        start_new = not current_group or not last_was_subpart
-                else:
-                    # (b), (c), etc. -> continuation of subparts
-                    start_new = False
-            
+                # (a) starts a new question if the current one already has subparts or
+                # the previous segment wasn't a subpart; (b), (c), etc. continue it
+                start_new = seg_is_first_subpart[i] and (has_subparts or not last_was_subpart)
             else:
-                # No number, no subpart prefix
-                # Heuristic: If marks >= 3 and previous had subparts, this is likely new
-                if current_group and current_group['has_subparts'] and marks >= 3:
-                    start_new = True
-                # Or if there's a clear topic shift
-                elif re.search(r'(Show that|Prove that|Consider|Calculate|Find the)', text[:100], re.IGNORECASE):
-                    if current_group and len(current_group['segments']) > 0:
-                        start_new = True
+                # No number, no subpart prefix: high marks after subparts, or a clear topic shift
+                start_new = ((has_subparts and seg_marks[i] >= 3)
+                             or TOPIC_SHIFT_PATTERN.search(seg_texts[i], 0, 100) is not None)
             
-            # Apply the decision
             if start_new:
-                if current_group:
-                    question_groups.append(current_group)
-                current_group = {
-                    'segments': [seg],
-                    'total_marks': marks,
-                    'has_subparts': is_subpart
-                }
-                last_was_subpart = is_subpart
-            
+                splits.append(i)
+                has_subparts = is_subpart
             else:
-                # Add to current group
-                if current_group:
-                    current_group['segments'].append(seg)
-                    current_group['total_marks'] += marks
-                    if is_subpart:
-                        current_group['has_subparts'] = True
-                    last_was_subpart = is_subpart
-                else:
-                    # Start new group
-                    current_group = {
-                        'segments': [seg],
-                        'total_marks': marks,
-                        'has_subparts': is_subpart
-                    }
-                    last_was_subpart = is_subpart
-        
-        # Add last group
-        if current_group:
-            question_groups.append(current_group)
-        
-        # Convert groups to Question objects
-        for idx, group in enumerate(question_groups, start=1):
+                has_subparts = has_subparts or is_subpart
+            last_was_subpart = is_subpart
+        
+        # Convert groups (segment ranges between split points) to Question objects
+        bounds = splits + [n]
+        for idx, (first, last) in enumerate(zip(bounds, bounds[1:]), start=1):
             try:
                 # Combine all segment texts
-                full_text = "\n\n".join(s['text'] for s in group['segments'])
+                full_text = "\n\n".join(seg_texts[first:last])
                 
-                # Try to find explicit question number
-                num_match = re.search(r'(?:^|\n)\s*(\d+)\.\s+', full_text)
-                q_num = int(num_match.group(1)) if num_match else idx
+                # Use the first explicit question number among the segments
+                q_num = next((num for num in seg_numbers[first:last] if num is not None), idx)
                 
                 q_type = self._classify_question_type(full_text)
                 
@@ -236,16 +369,17 @@ class StructureAnalyzerAgent:
                 if q_type == QuestionType.MCQ:
                     options = self._extract_mcq_options(full_text)
                 
-                # Find associated diagrams
-                associated_diagrams = []
-                for diagram in all_diagrams[:2]:
-                    if diagram.relevance == "high":
-                        associated_diagrams.append(diagram)
+                # Find associated diagrams on the question's own pages
+                associated_diagrams = self._diagrams_for_span(
+                    diagrams_by_page, page_offsets,
+                    seg_starts[first], seg_ends[last - 1],
+                    high_only=True
+                )
                 
                 question = Question(
                     question_number=str(q_num),
                     sub_parts=[],
-                    marks=group['total_marks'],
+                    marks=sum(seg_marks[first:last]),
                     question_type=q_type,
                     question_text=full_text,
                     options=options,
@@ -265,117 +399,118 @@ class StructureAnalyzerAgent:
     def _old_parse_fallback(self, text: str, all_diagrams: List) -> List[Question]:
         """Old parsing logic kept as fallback"""
         questions = []
-        question_pattern = r'(?:^|\n)\s*(?:Q\.?\s*)?(\d+)([a-z]|\([a-z]\))?\s*[.)]\s*(.*?)(?=(?:\n\s*(?:Q\.?\s*)?\d+[a-z]?[.)]|\Z))'
-        matches = list(re.finditer(question_pattern, text, re.IGNORECASE | re.DOTALL))
-        
-        for match in matches:
-                try:
-                    q_num = match.group(1)
-                    sub_part = match.group(2) or ""
-                    q_text = match.group(3).strip()
-                    
-                    # Build question number
-                    if sub_part:
-                        sub_part = sub_part.strip('()')
-                        question_number = f"{q_num}{sub_part}"
-                    else:
-                        question_number = q_num
-                    
-                    # Extract marks
-                    marks = self._extract_marks(q_text)
-                    
-                    # Classify question type
-                    q_type = self._classify_question_type(q_text)
-                    
-                    # Extract MCQ options if applicable
-                    options = None
-                    if q_type == QuestionType.MCQ:
-                        options = self._extract_mcq_options(q_text)
-                    
-                    # Find associated diagrams (simple proximity matching)
-                    associated_diagrams = []
-                    for diagram in all_diagrams:
-                        if diagram.relevance == "high" and len(associated_diagrams) < 2:
-                            associated_diagrams.append(diagram)
-                    
-                    # Create question
-                    question = Question(
-                        question_number=question_number,
-                        sub_parts=[],  # Could be enhanced to detect sub-parts
-                        marks=marks,
-                        question_type=q_type,
-                        question_text=q_text,
-                        options=options,
-                        has_diagram=len(associated_diagrams) > 0,
-                        diagram_path=associated_diagrams[0].image_path if associated_diagrams else None,
-                        diagrams=associated_diagrams
-                    )
-                    
-                    questions.append(question)
-                    
-                except Exception as e:
-                    logger.warning(f"Failed to parse question: {e}")
-                    continue
+        
+        # Simple proximity matching: the first two high relevance diagrams
+        high_diagrams = list(islice((d for d in all_diagrams if d.relevance == "high"), 2))
+        
+        # Anchor, then scan forward for the body's end (no lazy .*? backtracking)
+        pos = 0
+        while True:
+            match = LEGACY_QUESTION_ANCHOR.search(text, pos)
+            if not match:
+                break
+            end = LEGACY_QUESTION_END.search(text, match.end())
+            pos = end.start() if end else len(text)
+            
+            try:
+                q_num = match.group(1)
+                sub_part = match.group(2) or ""
+                q_text = text[match.end():pos].strip()
+                
+                # Build question number
+                if sub_part:
+                    sub_part = sub_part.strip('()')
+                    question_number = f"{q_num}{sub_part}"
+                else:
+                    question_number = q_num
+                
+                # Extract marks
+                marks = self._extract_marks(q_text)
+                
+                # Classify question type
+                q_type = self._classify_question_type(q_text)
+                
+                # Extract MCQ options if applicable
+                options = None
+                if q_type == QuestionType.MCQ:
+                    options = self._extract_mcq_options(q_text)
+                
+                # Find associated diagrams (simple proximity matching)
+                associated_diagrams = list(high_diagrams)
+                
+                # Create question
+                question = Question(
+                    question_number=question_number,
+                    sub_parts=[],  # Could be enhanced to detect sub-parts
+                    marks=marks,
+                    question_type=q_type,
+                    question_text=q_text,
+                    options=options,
+                    has_diagram=len(associated_diagrams) > 0,
+                    diagram_path=associated_diagrams[0].image_path if associated_diagrams else None,
+                    diagrams=associated_diagrams
+                )
+                
+                questions.append(question)
+                
+            except Exception as e:
+                logger.warning(f"Failed to parse question: {e}")
+                continue
         
         return questions
     
     def _parse_answers(self, text: str, diagrams_by_page: List[List[Diagram]],
                       question_numbers: List[str], 
-                      ocr_results: List[OCRResult]) -> List[Answer]:
+                      ocr_results: List[OCRResult],
+                      page_offsets: List[int]) -> List[Answer]:
         """Parse student answers from text with improved pattern matching"""
         answers = []
         
-        # Flatten diagrams
-        all_diagrams = [d for page_diagrams in diagrams_by_page for d in page_diagrams]
-        
         # Calculate average OCR confidence
         avg_confidence = sum(r.confidence for r in ocr_results) / len(ocr_results) if ocr_results else 0.5
         
-        # Find answer patterns
+        # Determine handwriting quality (sheet-wide, so the same for every answer)
+        hw_quality = "good"
+        if avg_confidence < 0.6:
+            hw_quality = "poor"
+        elif avg_confidence < 0.75:
+            hw_quality = "fair"
+        
+        # Locate all answers in one pass over the text
+        located = self._locate_answers(text)
+        
         for q_num in question_numbers:
-            # Try multiple patterns to find the answer
-            patterns = [
-                # Pattern 1: "Q1", "Q2", etc.
-                rf'(?:^|\n)\s*Q\.?\s*{re.escape(q_num)}\s*[:.)]?\s*(.*?)(?=(?:\n\s*(?:Q|Solution)\s*\.?\s*\d+|\Z))',
-                # Pattern 2: "Solution 1:", "Solution 2:", etc.
-                rf'(?:^|\n)\s*Solution\s+{re.escape(q_num)}\s*:\s*(.*?)(?=(?:\n\s*(?:Q|Solution)\s*\.?\s*\d+|\Z))',
-                # Pattern 3: Just the number with markers "1.", "2.", "7_", etc.
-                rf'(?:^|\n)\s*{re.escape(q_num)}\s*[_:.)\-]\s*(.*?)(?=(?:\n\s*\d+\s*[_:.)\-]|\Z))',
-                # Pattern 4: Relaxed pattern for any format
-                rf'(?:^|\n).*?{re.escape(q_num)}.*?[:.)]?\s*(.*?)(?=(?:\n\s*(?:Q|Solution)?\s*\.?\s*\d+[_:.)\-]|\Z))',
-            ]
+            span = located.get(q_num)
             
-            match = None
-            for pattern in patterns:
-                match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-                if match:
-                    break
+            if span is None:
+                # Unusual numbering, fall back to per-question patterns
+                for pattern in _answer_patterns(q_num):
+                    match = pattern.search(text)
+                    if match:
+                        span = match.span(1)
+                        break
             
-            if match:
-                answer_text = match.group(1).strip()
+            if span is not None:
+                answer_text = text[span[0]:span[1]].strip()
                 
                 # Separate working from final answer (heuristic)
                 working = None
                 if len(answer_text) > 100:  # Likely has working
-                    # Try to find "Answer:" or similar markers
-                    final_answer_match = re.search(r'(?:final\s+)?answer\s*:?\s*(.+?)(?:\n|$)', 
-                                                   answer_text, re.IGNORECASE)
+                    # Try to find "Answer:" or similar markers; the regex can only
+                    # match at the first "answer" or at a "final" just before it
+                    marker = _lowered(answer_text).find('answer')
+                    final_answer_match = None
+                    if marker != -1:
+                        start = max(0, len(answer_text[:marker].rstrip()) - len('final'))
+                        final_answer_match = FINAL_ANSWER_PATTERN.search(answer_text, start)
                     if final_answer_match:
                         working = answer_text[:final_answer_match.start()]
                         answer_text = final_answer_match.group(1).strip()
                 
-                # Find associated diagrams
-                associated_diagrams = []
-                for diagram in all_diagrams:
-                    if len(associated_diagrams) < 2:  # Limit to 2 diagrams per answer
-                        associated_diagrams.append(diagram)
-                
-                # Determine handwriting quality
-                hw_quality = "good"
-                if avg_confidence < 0.6:
-                    hw_quality = "poor"
-                elif avg_confidence < 0.75:
-                    hw_quality = "fair"
+                # Find associated diagrams on the answer's own pages
+                associated_diagrams = self._diagrams_for_span(
+                    diagrams_by_page, page_offsets, span[0], span[1]
+                )
                 
                 # Create answer
                 answer = Answer(
@@ -406,49 +541,75 @@ class StructureAnalyzerAgent:
         
         return answers
     
+    def _locate_answers(self, text: str) -> Dict[str, Tuple[int, int]]:
+        """
+        Find the answer text for every marked question number in one pass
+        
+        A number's answer comes from its first "Q" marker, else its first
+        "Solution" marker, else its first bare number marker. Labelled answers
+        run to the next "Q"/"Solution" label; numbered answers to the next
+        number marker.
+        
+        Args:
+            text: Full answer sheet text
+            
+        Returns:
+            Dictionary of question number -> (start, end) of its answer text
+        """
+        # First start offset per (marker kind, number)
+        starts = {}
+        for match in ANSWER_MARKER_PATTERN.finditer(text):
+            kind = match.lastgroup
+            starts.setdefault((kind, match.group(kind)), match.end())
+        
+        labelled_ends = [m.start() for m in LABELLED_ANSWER_END_PATTERN.finditer(text)]
+        numbered_ends = [m.start() for m in NUMBERED_ANSWER_END_PATTERN.finditer(text)]
+        
+        located = {}
+        for kind, ends in (('q', labelled_ends), ('s', labelled_ends), ('n', numbered_ends)):
+            for (marker_kind, q_num), start in starts.items():
+                if marker_kind != kind or q_num in located:
+                    continue
+                i = bisect.bisect_left(ends, start)
+                located[q_num] = (start, ends[i] if i < len(ends) else len(text))
+        
+        return located
+    
     def _classify_question_type(self, text: str) -> QuestionType:
         """Classify question type based on text content"""
-        text_lower = text.lower()
+        # Type cues sit in the question's opening; bound the scan and lowercase only that
+        end = min(len(text), self.CLASSIFY_SCAN_CHARS)
         
-        # MCQ indicators
-        if re.search(r'\b[a-e]\)', text_lower) or 'choose' in text_lower or 'select' in text_lower:
-            return QuestionType.MCQ
+        head = _lowered(text[:end])
         
-        # Derivation/Proof indicators
-        if any(word in text_lower for word in ['derive', 'proof', 'prove', 'show that']):
-            return QuestionType.DERIVATION
+        # MCQ indicators (all end in ')', so skip the regex when there is none)
+        if ')' in head and MCQ_INDICATOR_PATTERN.search(head):
+            return QuestionType.MCQ
         
-        # Diagram indicators
-        if any(word in text_lower for word in ['draw', 'sketch', 'diagram', 'plot', 'graph']):
-            return QuestionType.DIAGRAM
+        # Highest priority keyword type found in the scanned text, in one pass
+        best = None
+        for match in QUESTION_TYPE_KEYWORD_PATTERN.finditer(head):
+            priority = QUESTION_TYPE_PRIORITY[match.lastgroup]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
         
-        # Code indicators
-        if any(word in text_lower for word in ['code', 'program', 'implement', 'algorithm']):
-            return QuestionType.CODE
+        if best is None:
+            return QuestionType.SHORT_ANSWER
         
-        # Numerical indicators
-        if any(word in text_lower for word in ['calculate', 'compute', 'find', 'determine']):
-            return QuestionType.NUMERICAL
+        q_type = QUESTION_TYPE_KEYWORDS[best][0]
         
-        # Essay indicators
-        if any(word in text_lower for word in ['explain', 'discuss', 'describe', 'compare']):
-            if len(text) > 200:  # Long question likely essay
-                return QuestionType.ESSAY
+        # Essay indicators only mean an essay for long questions
+        if q_type == QuestionType.ESSAY and len(text) <= 200:
             return QuestionType.SHORT_ANSWER
-        
-        return QuestionType.SHORT_ANSWER
+        return q_type
     
     def _extract_marks(self, text: str) -> float:
         """Extract marks from question text"""
         # Patterns: [5 marks], (5 marks), [5M], (5), 5 marks
-        patterns = [
-            r'\[(\d+)\s*(?:marks?|m)\]',
-            r'\((\d+)\s*(?:marks?|m)\)',
-            r'(\d+)\s*marks?',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in MARKS_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return float(match.group(1))
         
@@ -456,47 +617,40 @@ class StructureAnalyzerAgent:
     
     def _extract_mcq_options(self, text: str) -> Optional[Dict[str, str]]:
         """Extract MCQ options from text"""
-        options = {}
+        # Every option marker ends in ')'; essays and derivations usually have none
+        if ')' not in text:
+            return None
         
-        # Find options a), b), c), etc.
-        option_pattern = r'([a-e])\)\s*([^\n]+?)(?=\s*[a-e]\)|\Z)'
-        matches = re.finditer(option_pattern, text, re.IGNORECASE)
+        # Find options a), b), c), etc. as (letter, text) tuples, no Match objects
+        pairs = MCQ_OPTIONS_PATTERN.findall(text)
+        if not pairs:
+            return None
         
-        for match in matches:
-            letter = match.group(1).lower()
-            option_text = match.group(2).strip()
-            options[letter] = option_text
-        
-        return options if options else None
+        return {letter.lower(): option_text.strip() for letter, option_text in pairs}
     
     def _extract_student_info(self, text: str) -> Dict[str, str]:
         """Extract student information from answer sheet"""
         info = {}
         
+        # Match on lowercased text, then slice the original to keep its case
+        lowered = _lowered(text)
+        
         # Extract name
-        name_patterns = [
-            r'name\s*:?\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
-            r'student\s+name\s*:?\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)',
-        ]
-        for pattern in name_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in NAME_PATTERNS:
+            match = pattern.search(lowered)
             if match:
-                info['name'] = match.group(1).strip()
+                info['name'] = text[match.start(1):match.end(1)].strip()
                 break
         
         # Extract ID
-        id_patterns = [
-            r'(?:student\s+)?id\s*:?\s*([A-Z0-9]+)',
-            r'roll\s+(?:no|number)\s*:?\s*([A-Z0-9]+)',
-        ]
-        for pattern in id_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in ID_PATTERNS:
+            match = pattern.search(lowered)
             if match:
-                info['id'] = match.group(1).strip()
+                info['id'] = text[match.start(1):match.end(1)].strip()
                 break
         
         # Extract email
-        email_match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', text)
+        email_match = EMAIL_PATTERN.search(text)
         if email_match:
             info['email'] = email_match.group(0)
         
@@ -1,6 +1,15 @@
+import functools
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
+
+
+@functools.lru_cache(maxsize=None)
+def _ensure_directories(directories: Tuple[Path, ...]):
+    """Create missing directories (once per process for a given set)"""
+    for directory in directories:
+        if not directory.is_dir():
+            directory.mkdir(parents=True, exist_ok=True)
 
 
 class Settings(BaseSettings):
@@ -16,6 +25,9 @@ class Settings(BaseSettings):
     # API Configuration
     anthropic_api_key: str
     anthropic_model: str = "claude-3-opus-20240229"
+    vision_max_image_size: int = 1568  # Long-side cap for images sent to Claude (0 = no cap)
+    use_batch_api: bool = False  # Message Batches API for bulk math OCR (half price, not interactive)
+    batch_max_wait: int = 3600  # Seconds before a stuck message batch is cancelled and redone with direct calls
     
     # Paths
     base_dir: Path = Path(__file__).parent.parent
@@ -28,22 +40,32 @@ class Settings(BaseSettings):
     # Image Processing
     dpi: int = 600
     use_gpu: bool = True
-    parallel_processing: bool = False
+    max_page_workers: int = 0  # 0 = one worker per CPU core
+    enable_page_cache: bool = True  # Reuse rendered pages for unchanged PDFs
     
     # OCR Configuration
     use_multi_ocr: bool = True
     ocr_confidence_threshold: float = 0.70
+    min_text_chars: int = 10  # Less OCR text than this on an ink-free page means a blank page
     handwriting_detection_threshold: float = 0.60
+    ocr_workers: int = 4  # Pages OCR'd in parallel
+    ocr_batch_size: int = 4  # Handwritten pages per EasyOCR detector pass
+    enable_ocr_cache: bool = True  # Reuse OCR results for unchanged pages
     
     # Diagram Extraction
     min_diagram_size: int = 5000
     use_ai_diagram_detection: bool = True
     image_quality_threshold: float = 50.0
+    enable_detection_cache: bool = True  # Reuse AI detections for unchanged pages
     
     # Grading Configuration
     enable_partial_credit: bool = True
     semantic_similarity_threshold: float = 0.80
     math_equation_matching: bool = True
+    quantize_similarity_model: bool = True  # INT8 dynamic quantization on CPU
+    enable_grading_cache: bool = False  # Reuse AI grades for identical answers
+    grading_cache_threshold: float = 0.92
+    max_concurrent_api_calls: int = 8
     
     # Logging
     log_level: str = "INFO"
@@ -57,9 +79,8 @@ class Settings(BaseSettings):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # Create directories if they don't exist
-        for directory in [self.input_dir, self.output_dir, self.images_dir, 
-                         self.temp_dir, self.logs_dir]:
-            directory.mkdir(parents=True, exist_ok=True)
+        _ensure_directories((self.input_dir, self.output_dir, self.images_dir,
+                             self.temp_dir, self.logs_dir))
 
 
 # Global settings instance
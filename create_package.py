@@ -3,11 +3,25 @@
 Script to create a distributable package of the exam grading system
 """
 
+import fnmatch
 import os
 import zipfile
 from pathlib import Path
 from datetime import datetime
 
+# Already-compressed formats gain nothing from DEFLATE, so they are stored as-is
+PRECOMPRESSED_SUFFIXES = {'.png', '.jpg', '.jpeg', '.pdf', '.zip', '.gz'}
+
+
+def add_file(zipf: zipfile.ZipFile, file_path: str, arcname: str):
+    """Write a file into the package, skipping recompression of compressed formats"""
+    if os.path.splitext(file_path)[1].lower() in PRECOMPRESSED_SUFFIXES:
+        zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
+    else:
+        zipf.write(file_path, arcname)
+    print(f"Added: {arcname}")
+
+
 def create_package():
     """Create a zip package of the complete system"""
     
@@ -60,8 +74,7 @@ def create_package():
                 gitkeep_path.touch()
                 
                 arcname = os.path.join("exam-grading-system", pattern.rstrip('/'), ".gitkeep")
-                zipf.write(gitkeep_path, arcname)
-                print(f"Added: {arcname}")
+                add_file(zipf, gitkeep_path, arcname)
                 file_count += 1
             elif '*' in pattern:
                 # Wildcard pattern
@@ -69,19 +82,19 @@ def create_package():
                 if len(parts) == 2:
                     directory = base_dir / parts[0]
                     if directory.exists():
-                        for file in directory.glob(parts[1]):
-                            if file.is_file():
-                                arcname = os.path.join("exam-grading-system", parts[0], file.name)
-                                zipf.write(file, arcname)
-                                print(f"Added: {arcname}")
-                                file_count += 1
+                        # One directory scan; entries carry their type, no Path per file
+                        with os.scandir(directory) as entries:
+                            for entry in entries:
+                                if entry.is_file() and fnmatch.fnmatchcase(entry.name, parts[1]):
+                                    arcname = os.path.join("exam-grading-system", parts[0], entry.name)
+                                    add_file(zipf, entry.path, arcname)
+                                    file_count += 1
             else:
                 # Single file
                 file_path = base_dir / pattern
                 if file_path.exists():
                     arcname = os.path.join("exam-grading-system", pattern)
-                    zipf.write(file_path, arcname)
-                    print(f"Added: {arcname}")
+                    add_file(zipf, file_path, arcname)
                     file_count += 1
     
     # Get file size
@@ -9,6 +9,7 @@ logger.remove()
 logger.add(sys.stderr, level="INFO")
 
 from agents import OCRAgent
+from agents.structure_analyzer import MARKS_INDICATOR_PATTERN
 from config.settings import settings
 
 # Get images
@@ -26,10 +27,8 @@ print("\n=== FULL OCR TEXT ===\n")
 print(full_text)
 print("\n=== END ===\n")
 
-# Find all marks indicators
-import re
-marks_pattern = r'\((\d+)\s*Marks?\)'
-marks_matches = list(re.finditer(marks_pattern, full_text, re.IGNORECASE))
+# Find all marks indicators (the same compiled pattern the question parser uses)
+marks_matches = list(MARKS_INDICATOR_PATTERN.finditer(full_text))
 
 print(f"\nFound {len(marks_matches)} marks indicators:")
 for i, m in enumerate(marks_matches, 1):
@@ -2,6 +2,7 @@
 """
 Enhanced answer extraction using Claude Vision API for complex mathematical content
 """
+import re
 import sys
 from pathlib import Path
 from loguru import logger
@@ -12,54 +13,56 @@ logger.add(sys.stderr, level="INFO")
 from utils.math_ocr import MathOCR
 from agents.ocr_agent import OCRAgent
 from config.settings import settings
-import json
+from pydantic_core import from_json, to_json
 
 # Get answer sheet images
 images_dir = settings.images_dir / "answer_A1_solution"
 image_paths = sorted(list(images_dir.glob("*.png")))
 
 print(f"\nProcessing {len(image_paths)} answer sheet images...")
-print("Using Claude Vision API for Q6 and Q8 (complex mathematical content)")
+print("Using regular OCR first, Claude Vision for low-confidence or math-heavy pages")
 
-# Use Vision API for specific pages containing Q6 and Q8
 math_ocr = MathOCR()
+ocr_agent = OCRAgent()
 
-# Map of pages to extract with Vision API (0-indexed)
-vision_pages = {
-    4: "Q5b + Q6",  # Page 5
-    5: "Q7",        # Page 6  
-    6: "Q7 cont",   # Page 7
-    7: "Q8 start",  # Page 8
-    8: "Q8 plots",  # Page 9
-    9: "Q8 plots",  # Page 10
-    10: "Q8 conclusions", # Page 11
-    11: "Q8 code"   # Page 12
-}
+# Tier 1: cheap local OCR on every page (MathOCR below is the Vision tier)
+print("\n" + "="*80)
+print("EXTRACTING WITH REGULAR OCR")
+print("="*80)
+ocr_results = ocr_agent.process_images(
+    [str(p) for p in image_paths], is_handwritten=True, vision_fallback=False
+)
+
+# Tier 2: upgrade pages the local OCR is unsure of or that contain math notation
+vision_indices = [
+    i for i, result in enumerate(ocr_results)
+    if result.has_math or ocr_agent.ocr_engine.needs_claude_vision(result)
+]
+print(f"Upgrading {len(vision_indices)}/{len(image_paths)} pages to Claude Vision")
 
-# Extract text from all pages using Vision API for better accuracy
 print("\n" + "="*80)
 print("EXTRACTING WITH CLAUDE VISION API")
 print("="*80)
+vision_texts = math_ocr.extract_math_batch([image_paths[i] for i in vision_indices])
+page_texts = dict(zip(vision_indices, vision_texts))
 
 all_page_texts = []
 for i, img_path in enumerate(image_paths):
     page_num = i + 1
+    result = ocr_results[i]
     
-    if i in vision_pages:
-        print(f"\n📄 Page {page_num} ({vision_pages[i]})...")
-        text = math_ocr.extract_math(img_path)
-        if text:
-            all_page_texts.append({
-                'page': page_num,
-                'text': text,
-                'method': 'vision_api'
-            })
-            print(f"✓ Extracted {len(text)} characters")
+    text = page_texts.get(i)
+    if text:
+        print(f"\n📄 Page {page_num} (Claude Vision, OCR confidence {result.confidence:.2f})...")
+        all_page_texts.append({
+            'page': page_num,
+            'text': text,
+            'method': 'vision_api'
+        })
+        print(f"✓ Extracted {len(text)} characters")
     else:
-        # Use regular OCR for simpler pages
+        # Regular OCR sufficed (or the Vision upgrade failed)
         print(f"\n📄 Page {page_num} (using regular OCR)...")
-        ocr_agent = OCRAgent()
-        result = ocr_agent.process_single_image(str(img_path), is_handwritten=True)
         all_page_texts.append({
             'page': page_num,
             'text': result.text,
@@ -80,23 +83,43 @@ question_numbers = ['1', '2', '3', '4', '5', '6', '7', '8']
 # Manual extraction based on content analysis
 answers_data = []
 
-# Find Q6 (should be on pages 5-6)
-q6_text = ""
-for p in all_page_texts:
-    if "Solution 6" in p['text'] or "ψ(k)" in p['text']:
-        q6_text += p['text'] + "\n"
+# Content markers for each question, found in one scan per page. The lookahead
+# reports overlapping markers; Q6 markers are case-sensitive, Q7/Q8 are not
+QUESTION_MARKERS = re.compile(
+    r'(?=(?P<q6>Solution 6|ψ\(k\))'
+    r'|(?P<q7>(?i:normalization|stationary))'
+    r'|(?P<q8>(?i:transmission|matlab|plot)))'
+)
+
+
+def find_markers(text: str) -> set:
+    """Questions whose content markers appear in the text"""
+    hits = set()
+    for match in QUESTION_MARKERS.finditer(text):
+        hits.add(match.lastgroup)
+        if len(hits) == 3:
+            break
+    return hits
+
+
+# Whether a page number can hold each question's answer
+QUESTION_PAGES = {
+    'q6': lambda page: True,            # should be on pages 5-6, any page accepted
+    'q7': lambda page: page in (6, 7),  # should be on pages 6-7
+    'q8': lambda page: page >= 8,       # should be on pages 8-12, later pages accepted
+}
 
-# Find Q7 (should be on pages 6-7)
-q7_text = ""
+# One pass routes each page into every bucket it belongs to
+buckets = {qid: [] for qid in QUESTION_PAGES}
 for p in all_page_texts:
-    if p['page'] in [6, 7] and ("normalization" in p['text'].lower() or "stationary" in p['text'].lower()):
-        q7_text += p['text'] + "\n"
+    for qid in find_markers(p['text']):
+        if QUESTION_PAGES[qid](p['page']):
+            buckets[qid].append(p['text'])
 
-# Find Q8 (should be on pages 8-12)
-q8_text = ""
-for p in all_page_texts:
-    if p['page'] >= 8 and ("transmission" in p['text'].lower() or "matlab" in p['text'].lower() or "plot" in p['text'].lower()):
-        q8_text += p['text'] + "\n"
+# Each page's text is followed by a newline, joined once per bucket
+q6_text, q7_text, q8_text = (
+    "".join(f"{text}\n" for text in buckets[qid]) for qid in ('q6', 'q7', 'q8')
+)
 
 print(f"\n✓ Q6 extracted: {len(q6_text)} chars")
 print(f"✓ Q7 extracted: {len(q7_text)} chars")
@@ -111,8 +134,7 @@ output_data = {
     "all_pages": all_page_texts
 }
 
-with open(output_file, 'w') as f:
-    json.dump(output_data, f, indent=2)
+output_file.write_bytes(to_json(output_data, indent=2))
 
 print(f"\n✓ Saved enhanced extraction to: {output_file}")
 print("\nNow updating answer sheet JSON with improved Q6 and Q8 extraction...")
@@ -120,8 +142,7 @@ print("\nNow updating answer sheet JSON with improved Q6 and Q8 extraction...")
 # Update the answer sheet JSON
 answer_sheet_file = settings.output_dir / "answer_sheet_A1_solution.json"
 if answer_sheet_file.exists():
-    with open(answer_sheet_file, 'r') as f:
-        answer_data = json.load(f)
+    answer_data = from_json(answer_sheet_file.read_bytes())
     
     # Update Q6 and Q8 answers
     for answer in answer_data['answers']:
@@ -136,8 +157,7 @@ if answer_sheet_file.exists():
             print(f"✓ Updated Q8 answer ({len(q8_text)} chars)")
     
     # Save updated answer sheet
-    with open(answer_sheet_file, 'w') as f:
-        json.dump(answer_data, f, indent=2)
+    answer_sheet_file.write_bytes(to_json(answer_data, indent=2))
     
     print(f"\n✓ Updated answer sheet saved to: {answer_sheet_file}")
 
@@ -6,31 +6,78 @@ Orchestrates the complete workflow from PDF to graded results
 
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from loguru import logger
-import json
 
+import agents
 from config.settings import settings
-from agents import (DocumentProcessorAgent, OCRAgent, ImageExtractorAgent,
-                   StructureAnalyzerAgent, JSONGeneratorAgent, GradingAgent)
+from models.schemas import QuestionPaperJSON, SolutionPaperJSON, AnswerSheetJSON
 
 
 class ExamGradingPipeline:
     """Main pipeline for exam grading system"""
     
     def __init__(self):
-        # Initialize all agents
-        self.doc_processor = DocumentProcessorAgent()
-        self.ocr_agent = OCRAgent()
-        self.image_extractor = ImageExtractorAgent()
-        self.structure_analyzer = StructureAnalyzerAgent()
-        self.json_generator = JSONGeneratorAgent()
-        self.grading_agent = GradingAgent()
-        
+        # Agents are created (and their modules imported) on first use, so a
+        # grading-only run never loads the OCR and image extraction stack
         logger.info("Exam Grading Pipeline initialized")
     
-    def process_question_paper(self, pdf_path: str) -> str:
+    @cached_property
+    def doc_processor(self) -> 'agents.DocumentProcessorAgent':
+        return agents.DocumentProcessorAgent()
+    
+    @cached_property
+    def ocr_agent(self) -> 'agents.OCRAgent':
+        return agents.OCRAgent()
+    
+    @cached_property
+    def image_extractor(self) -> 'agents.ImageExtractorAgent':
+        return agents.ImageExtractorAgent()
+    
+    @cached_property
+    def structure_analyzer(self) -> 'agents.StructureAnalyzerAgent':
+        return agents.StructureAnalyzerAgent()
+    
+    @cached_property
+    def json_generator(self) -> 'agents.JSONGeneratorAgent':
+        return agents.JSONGeneratorAgent()
+    
+    @cached_property
+    def grading_agent(self) -> 'agents.GradingAgent':
+        return agents.GradingAgent()
+    
+    def _ocr_and_extract_diagrams(self, image_paths: List[str], is_handwritten: bool,
+                                  output_dir: str) -> Tuple[List, List[List]]:
+        """
+        Run OCR and diagram extraction over the same pages concurrently
+        
+        Both stages only read the page images and are independent. OCR already
+        fans pages out over its own worker pool, so diagram extraction runs
+        alongside it on one extra thread.
+        
+        Args:
+            image_paths: Page image paths
+            is_handwritten: Whether pages contain handwriting
+            output_dir: Directory for extracted diagrams
+            
+        Returns:
+            (ocr_results, diagrams_by_page)
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            diagrams_future = executor.submit(
+                self.image_extractor.extract_diagrams_from_pages,
+                image_paths,
+                output_dir=output_dir
+            )
+            ocr_results = self.ocr_agent.process_images(image_paths, is_handwritten=is_handwritten)
+            diagrams_by_page = diagrams_future.result()
+        
+        return ocr_results, diagrams_by_page
+    
+    def process_question_paper(self, pdf_path: str) -> Tuple[str, List[str]]:
         """
         Process question paper PDF
         
@@ -38,7 +85,7 @@ class ExamGradingPipeline:
             pdf_path: Path to question paper PDF
             
         Returns:
-            Path to generated JSON file
+            (path to generated JSON file, question numbers in paper order)
         """
         logger.info("=" * 80)
         logger.info("PROCESSING QUESTION PAPER")
@@ -53,14 +100,12 @@ class ExamGradingPipeline:
             output_subdir="question_paper"
         )
         
-        # Stage 2: OCR
+        # Stages 2-3: OCR and diagram extraction (run concurrently)
         logger.info("[2/4] Performing OCR on printed text...")
-        ocr_results = self.ocr_agent.process_images(image_paths, is_handwritten=False)
-        
-        # Stage 3: Diagram extraction
         logger.info("[3/4] Extracting diagrams and figures...")
-        diagrams_by_page = self.image_extractor.extract_diagrams_from_pages(
+        ocr_results, diagrams_by_page = self._ocr_and_extract_diagrams(
             image_paths,
+            is_handwritten=False,
             output_dir=str(settings.images_dir / "question_diagrams")
         )
         
@@ -82,7 +127,7 @@ class ExamGradingPipeline:
         logger.success(f"Question paper processed in {processing_time:.2f}s")
         logger.info(f"JSON saved to: {json_path}")
         
-        return json_path
+        return json_path, [q.question_number for q in questions]
     
     def process_solution_paper(self, pdf_path: str) -> str:
         """
@@ -107,14 +152,12 @@ class ExamGradingPipeline:
             output_subdir="solution_paper"
         )
         
-        # Stage 2: OCR (may include handwriting)
+        # Stages 2-3: OCR (may include handwriting) and diagram extraction
         logger.info("[2/4] Performing OCR...")
-        ocr_results = self.ocr_agent.process_images(image_paths, is_handwritten=True)
-        
-        # Stage 3: Diagram extraction
         logger.info("[3/4] Extracting diagrams and figures...")
-        diagrams_by_page = self.image_extractor.extract_diagrams_from_pages(
+        ocr_results, diagrams_by_page = self._ocr_and_extract_diagrams(
             image_paths,
+            is_handwritten=True,
             output_dir=str(settings.images_dir / "solution_diagrams")
         )
         
@@ -163,14 +206,12 @@ class ExamGradingPipeline:
             output_subdir=f"answer_{Path(pdf_path).stem}"
         )
         
-        # Stage 2: OCR (handwritten)
+        # Stages 2-3: OCR (handwritten) and diagram extraction
         logger.info("[2/4] Performing handwriting OCR...")
-        ocr_results = self.ocr_agent.process_images(image_paths, is_handwritten=True)
-        
-        # Stage 3: Diagram extraction
         logger.info("[3/4] Extracting diagrams...")
-        diagrams_by_page = self.image_extractor.extract_diagrams_from_pages(
+        ocr_results, diagrams_by_page = self._ocr_and_extract_diagrams(
             image_paths,
+            is_handwritten=True,
             output_dir=str(settings.images_dir / f"answer_diagrams_{Path(pdf_path).stem}")
         )
         
@@ -215,35 +256,19 @@ class ExamGradingPipeline:
         
         start_time = time.time()
         
-        # Load JSONs
-        if solution_json:
-            logger.info("Loading question paper, solution paper, and answer sheet...")
-            question_data = self.json_generator.load_json(question_json)
-            solution_data = self.json_generator.load_json(solution_json)
-            answer_data = self.json_generator.load_json(answer_json)
-        else:
-            logger.info("Loading question paper and answer sheet (no solution paper)...")
-            question_data = self.json_generator.load_json(question_json)
-            answer_data = self.json_generator.load_json(answer_json)
-        
-        # Parse data structures
-        from models.schemas import Question, Answer
-        
-        questions = []
+        # Load JSONs straight into the schema models
         if solution_json:
+            logger.info("Loading solution paper and answer sheet...")
             # Use solution paper if available
-            for q_dict in solution_data['solutions']:
-                questions.append(Question(**q_dict))
+            questions = self.json_generator.load_model(solution_json, SolutionPaperJSON).solutions
         else:
+            logger.info("Loading question paper and answer sheet (no solution paper)...")
             # Use question paper data without solutions
-            for q_dict in question_data['questions']:
-                questions.append(Question(**q_dict))
-        
-        answers = []
-        for a_dict in answer_data['answers']:
-            answers.append(Answer(**a_dict))
+            questions = self.json_generator.load_model(question_json, QuestionPaperJSON).questions
         
-        student_info = answer_data['student_info']
+        answer_sheet = self.json_generator.load_model(answer_json, AnswerSheetJSON)
+        answers = answer_sheet.answers
+        student_info = answer_sheet.student_info
         
         # Grade
         logger.info(f"Grading {len(answers)} answers...")
@@ -254,10 +279,9 @@ class ExamGradingPipeline:
         
         # Save grading report
         student_id = student_info.get('id', 'unknown')
-        output_path = settings.output_dir / f"grading_report_{student_id}.json"
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(report.model_dump(), f, indent=2, default=str)
+        output_path = self.json_generator.generate_grading_report_json(
+            report, f"grading_report_{student_id}.json"
+        )
         
         logger.success(f"Grading complete in {report.processing_time:.2f}s")
         logger.info(f"Report saved to: {output_path}")
@@ -333,7 +357,7 @@ def main():
     try:
         # Process question paper
         logger.info("Processing hardcoded question paper...")
-        question_json = pipeline.process_question_paper(QUESTION_PAPER_PDF)
+        question_json, question_numbers = pipeline.process_question_paper(QUESTION_PAPER_PDF)
         
         # Process solution paper (optional)
         solution_json = None
@@ -343,10 +367,6 @@ def main():
         else:
             logger.info("No solution paper provided - AI will grade based on question paper only")
         
-        # Get question numbers for answer sheet processing
-        data = pipeline.json_generator.load_json(question_json)
-        question_numbers = [q['question_number'] for q in data['questions']]
-        
         # Process answer sheet
         logger.info("Processing hardcoded answer sheet...")
         answer_json = pipeline.process_answer_sheet(ANSWER_SHEET_PDF, question_numbers)
@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict, Any
 from enum import Enum
 from datetime import datetime
+from functools import cached_property
 
 
 class QuestionType(str, Enum):
@@ -19,6 +20,8 @@ class QuestionType(str, Enum):
 
 class BoundingBox(BaseModel):
     """Bounding box coordinates as percentages"""
+    model_config = ConfigDict(frozen=True)
+
     x_min: float = Field(..., ge=0, le=100)
     y_min: float = Field(..., ge=0, le=100)
     x_max: float = Field(..., ge=0, le=100)
@@ -27,6 +30,8 @@ class BoundingBox(BaseModel):
 
 class OCRResult(BaseModel):
     """Result from OCR processing"""
+    model_config = ConfigDict(frozen=True)
+
     text: str
     confidence: float = Field(..., ge=0, le=1)
     engine: str  # tesseract, easyocr, claude_vision
@@ -37,6 +42,8 @@ class OCRResult(BaseModel):
 
 class Diagram(BaseModel):
     """Diagram extracted from document"""
+    model_config = ConfigDict(frozen=True)
+
     diagram_id: str
     type: str
     description: str
@@ -71,6 +78,11 @@ class Answer(BaseModel):
     ocr_confidence: float = Field(..., ge=0, le=1)
     handwriting_quality: str = "good"  # good, fair, poor
 
+    @cached_property
+    def full_text(self) -> str:
+        """Answer text followed by the working, as sent for AI grading"""
+        return self.answer_text + (f"\n\nWorking:\n{self.working}" if self.working else "")
+
 
 class PartialCreditBreakdown(BaseModel):
     """Breakdown of partial credit for a question"""
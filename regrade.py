@@ -3,14 +3,14 @@
 Regrade using the enhanced answer extraction
 """
 import sys
-import json
 from loguru import logger
 
 logger.remove()
 logger.add(sys.stderr, level="INFO")
 
 from agents.grading_agent import GradingAgent
-from models.schemas import Question, Answer
+from agents.json_generator import JSONGeneratorAgent
+from models.schemas import QuestionPaperJSON, AnswerSheetJSON
 from config.settings import settings
 
 print("\n" + "="*80)
@@ -21,25 +21,16 @@ print("="*80)
 question_paper_file = settings.output_dir / "question_paper.json"
 answer_sheet_file = settings.output_dir / "answer_sheet_A1_solution.json"
 
-with open(question_paper_file, 'r') as f:
-    question_paper = json.load(f)
+# Parse and validate straight into the schema models
+json_generator = JSONGeneratorAgent()
+questions = json_generator.load_model(question_paper_file, QuestionPaperJSON).questions
+answer_sheet = json_generator.load_model(answer_sheet_file, AnswerSheetJSON)
+answers = answer_sheet.answers
 
-with open(answer_sheet_file, 'r') as f:
-    answer_sheet = json.load(f)
+print(f"\nLoaded {len(questions)} questions")
+print(f"Loaded {len(answers)} answers")
 
-print(f"\nLoaded {len(question_paper['questions'])} questions")
-print(f"Loaded {len(answer_sheet['answers'])} answers")
-
-# Parse into proper objects
-questions = []
-for q_dict in question_paper['questions']:
-    questions.append(Question(**q_dict))
-
-answers = []
-for a_dict in answer_sheet['answers']:
-    answers.append(Answer(**a_dict))
-
-student_info = answer_sheet.get('student_info', {'name': 'Unknown', 'id': 'Unknown'})
+student_info = answer_sheet.student_info
 
 # Initialize grading agent
 grading_agent = GradingAgent()
@@ -57,8 +48,8 @@ graded_results = grading_agent.grade_answer_sheet(
 
 # Save results
 output_file = settings.output_dir / "grading_report_enhanced.json"
-with open(output_file, 'w') as f:
-    json.dump(graded_results.model_dump(), f, indent=2, default=str)
+with open(output_file, 'w', encoding='utf-8') as f:
+    f.write(graded_results.model_dump_json(indent=2))
 
 print(f"\n✓ Grading report saved to: {output_file}")
 
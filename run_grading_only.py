@@ -4,12 +4,11 @@ Quick script to run grading on already processed files
 """
 
 import sys
-import json
 from pathlib import Path
 from loguru import logger
 from config.settings import settings
 from agents import GradingAgent, JSONGeneratorAgent
-from models.schemas import Question, Answer
+from models.schemas import QuestionPaperJSON, AnswerSheetJSON
 
 
 def main():
@@ -27,20 +26,12 @@ def main():
     json_generator = JSONGeneratorAgent()
     grading_agent = GradingAgent()
     
-    # Load JSONs
-    question_data = json_generator.load_json(question_json)
-    answer_data = json_generator.load_json(answer_json)
+    # Load JSONs straight into the schema models - Use question paper since we don't have solutions
+    questions = json_generator.load_model(question_json, QuestionPaperJSON).questions
+    answer_sheet = json_generator.load_model(answer_json, AnswerSheetJSON)
+    answers = answer_sheet.answers
     
-    # Parse data structures - Use question paper since we don't have solutions
-    questions = []
-    for q_dict in question_data['questions']:
-        questions.append(Question(**q_dict))
-    
-    answers = []
-    for a_dict in answer_data['answers']:
-        answers.append(Answer(**a_dict))
-    
-    student_info = answer_data.get('student_info', {})
+    student_info = answer_sheet.student_info
     
     # Grade
     logger.info(f"Grading {len(answers)} answers using AI...")
@@ -48,10 +39,9 @@ def main():
     
     # Save grading report
     student_id = student_info.get('id', 'unknown')
-    output_path = settings.output_dir / f"grading_report_{student_id}_new.json"
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(report.model_dump(), f, indent=2, default=str)
+    output_path = json_generator.generate_grading_report_json(
+        report, f"grading_report_{student_id}_new.json"
+    )
     
     logger.success(f"Grading complete!")
     logger.info(f"Report saved to: {output_path}")
@@ -4,6 +4,7 @@ Test question paper re-processing with fixed structure analyzer
 """
 
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from loguru import logger
 
@@ -34,16 +35,16 @@ def main():
         logger.info("Processing question paper PDF...")
         image_paths, _ = doc_processor.process_document("A1.pdf", output_subdir="question_paper")
     
-    # OCR
-    logger.info("Performing OCR...")
-    ocr_results = ocr_agent.process_images(image_paths, is_handwritten=False)
-    
-    # Extract diagrams
-    logger.info("Extracting diagrams...")
-    diagrams_by_page = image_extractor.extract_diagrams_from_pages(
-        image_paths,
-        output_dir=str(settings.images_dir / "question_diagrams")
-    )
+    # OCR and diagram extraction only read the pages, so run them side by side
+    logger.info("Performing OCR and extracting diagrams...")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        diagrams_future = executor.submit(
+            image_extractor.extract_diagrams_from_pages,
+            image_paths,
+            output_dir=str(settings.images_dir / "question_diagrams")
+        )
+        ocr_results = ocr_agent.process_images(image_paths, is_handwritten=False)
+        diagrams_by_page = diagrams_future.result()
     
     # Analyze structure with FIXED parser
     logger.info("Analyzing structure with improved parser...")
@@ -1,13 +1,23 @@
-from .pdf_tools import PDFProcessor
-from .image_tools import ImageProcessor
-from .ocr_tools import OCREngine
-from .vision_api import ClaudeVisionAPI
-from .math_utils import MathProcessor
-
-__all__ = [
-    'PDFProcessor',
-    'ImageProcessor',
-    'OCREngine',
-    'ClaudeVisionAPI',
-    'MathProcessor'
-]
+import importlib
+
+# Tools are imported on first access (PEP 562), so importing one module
+# does not pull in the heavy dependencies of all the others
+_TOOLS = {
+    'PDFProcessor': '.pdf_tools',
+    'ImageProcessor': '.image_tools',
+    'OCREngine': '.ocr_tools',
+    'ClaudeVisionAPI': '.vision_api',
+    'MathProcessor': '.math_utils',
+    'SemanticCache': '.semantic_cache',
+    'PageCache': '.page_cache'
+}
+
+__all__ = list(_TOOLS)
+
+
+def __getattr__(name):
+    if name in _TOOLS:
+        value = getattr(importlib.import_module(_TOOLS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,14 +2,15 @@
 Mathematical OCR using Claude Vision API for accurate equation extraction
 """
 import anthropic
-import base64
-from PIL import Image
-from io import BytesIO
+import asyncio
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 from loguru import logger
 
 from config.settings import settings
+from utils.page_cache import PageCache
+from utils.vision_api import image_source
 
 
 MATH_OCR_PROMPT = """You are an expert at extracting mathematical equations and formulas from images.
@@ -34,6 +35,9 @@ Be extremely accurate with:
 
 Extract the content verbatim without summarizing or interpreting."""
 
+# Seconds between status checks while a message batch is processing
+BATCH_POLL_INTERVAL = 30
+
 
 class MathOCR:
     """Advanced mathematical OCR using Claude Vision API"""
@@ -42,57 +46,48 @@ class MathOCR:
         self.client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
         self.model = settings.anthropic_model
         
-    def _image_to_base64(self, image: Image.Image, max_size_mb: float = 3.5) -> str:
-        """
-        Convert PIL Image to base64 string with compression if needed
-        
-        Args:
-            image: PIL Image object
-            max_size_mb: Maximum size in MB before compression (default 3.5MB to stay well under 5MB after base64)
-        """
-        # Try to save with current quality
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        current_size = len(buffered.getvalue())
-        
-        # If size is acceptable, check base64 size
-        max_size_bytes = int(max_size_mb * 1024 * 1024)
-        
-        if current_size <= max_size_bytes:
-            # Check base64 encoded size
-            encoded = base64.b64encode(buffered.getvalue())
-            if len(encoded) <= 5242880:  # 5MB in bytes
-                return encoded.decode()
-        
-        logger.warning(f"Image size {current_size/1024/1024:.2f}MB, needs compression for API limit")
-        
-        # Base64 encoding increases size by ~33%, so target much smaller
-        # API limit is 5MB base64, so aim for ~3.7MB raw PNG
-        target_raw_bytes = 3700000  # 3.7MB target
-        resize_ratio = (target_raw_bytes / current_size) ** 0.5  # Square root for 2D resize
-        
-        new_width = int(image.width * resize_ratio)
-        new_height = int(image.height * resize_ratio)
-        
-        logger.info(f"Resizing from {image.width}x{image.height} to {new_width}x{new_height}")
-        
-        # Resize image
-        resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        # Save resized image with JPEG for better compression
-        buffered = BytesIO()
-        if resized.mode != 'RGB':
-            resized = resized.convert('RGB')
-        resized.save(buffered, format="JPEG", quality=85, optimize=True)
-        final_size = len(buffered.getvalue())
-        
-        # Check final base64 size
-        encoded = base64.b64encode(buffered.getvalue())
-        encoded_size = len(encoded)
-        
-        logger.success(f"Compressed: {current_size/1024/1024:.2f}MB → {final_size/1024/1024:.2f}MB (base64: {encoded_size/1024/1024:.2f}MB)")
-        
-        return encoded.decode()
+        # Extracted text across runs, keyed by page content, model and prompt
+        self.cache = None
+        if settings.enable_ocr_cache:
+            self.cache = PageCache(settings.temp_dir / "math_ocr_cache")
+    
+    def _cache_key(self, image_bytes: bytes) -> Optional[str]:
+        """Cache key for a page's file bytes, or None when caching is off"""
+        if self.cache is None:
+            return None
+        return self.cache.key(image_bytes, self.model, MATH_OCR_PROMPT,
+                              str(settings.vision_max_image_size))
+    
+    def _cached_text(self, key: Optional[str]) -> Optional[str]:
+        """Previously extracted text for a cache key, or None"""
+        return self.cache.get(key) if key is not None else None
+    
+    def _store_text(self, key: Optional[str], text: str):
+        """Cache extracted text for a cache key"""
+        if key is not None:
+            self.cache.put(key, text)
+    
+    def _math_request(self, image_bytes: bytes) -> Dict:
+        """Build message parameters for the math prompt from a page file's bytes"""
+        return dict(
+            model=self.model,
+            max_tokens=2048,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": image_source(image_bytes),
+                        },
+                        {
+                            "type": "text",
+                            "text": MATH_OCR_PROMPT
+                        }
+                    ],
+                }
+            ],
+        )
     
     def extract_math(self, image_path: Path) -> Optional[str]:
         """
@@ -105,47 +100,135 @@ class MathOCR:
             Extracted mathematical text with proper notation
         """
         try:
-            # Load and encode image
-            image = Image.open(image_path)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Read the file once for both the cache key and the request
+            image_bytes = Path(image_path).read_bytes()
             
-            image_base64 = self._image_to_base64(image)
+            key = self._cache_key(image_bytes)
+            cached = self._cached_text(key)
+            if cached is not None:
+                logger.debug(f"Math OCR cache hit for {image_path}")
+                return cached
             
             # Call Claude Vision API
-            message = self.client.messages.create(
-                model=self.model,
-                max_tokens=2048,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/jpeg",
-                                    "data": image_base64,
-                                },
-                            },
-                            {
-                                "type": "text",
-                                "text": MATH_OCR_PROMPT
-                            }
-                        ],
-                    }
-                ],
-            )
+            message = self.client.messages.create(**self._math_request(image_bytes))
             
             extracted_text = message.content[0].text
             logger.success(f"Extracted {len(extracted_text)} chars of mathematical content")
             
+            self._store_text(key, extracted_text)
             return extracted_text
             
         except Exception as e:
             logger.error(f"Math OCR failed: {e}")
             return None
     
+    def extract_math_batch(self, image_paths: List[Path]) -> List[Optional[str]]:
+        """
+        Extract mathematical content from several images with concurrent API calls
+        
+        Args:
+            image_paths: List of image paths
+            
+        Returns:
+            Extracted text per image, in input order (None where extraction failed)
+        """
+        if settings.use_batch_api and len(image_paths) > 1:
+            if hasattr(self.client.messages, "batches"):
+                return self._extract_math_message_batch(image_paths)
+            logger.warning("Installed anthropic SDK has no Message Batches API, using concurrent calls")
+        
+        return asyncio.run(self._extract_math_batch_async(image_paths))
+    
+    def _extract_math_message_batch(self, image_paths: List[Path]) -> List[Optional[str]]:
+        """Submit uncached pages as one Message Batch and wait for the results"""
+        texts: List[Optional[str]] = [None] * len(image_paths)
+        keys: List[Optional[str]] = [None] * len(image_paths)
+        requests = []
+        
+        for i, image_path in enumerate(image_paths):
+            try:
+                image_bytes = Path(image_path).read_bytes()
+                keys[i] = self._cache_key(image_bytes)
+                texts[i] = self._cached_text(keys[i])
+                if texts[i] is None:
+                    requests.append({"custom_id": f"page_{i}", "params": self._math_request(image_bytes)})
+            except Exception as e:
+                logger.error(f"Math OCR failed: {e}")
+        
+        if not requests:
+            return texts
+        
+        try:
+            batch = self.client.messages.batches.create(requests=requests)
+            logger.info(f"Submitted message batch {batch.id} with {len(requests)} pages")
+            
+            deadline = time.monotonic() + settings.batch_max_wait
+            while batch.processing_status != "ended":
+                if time.monotonic() >= deadline:
+                    # Stuck or slow batch: don't hang the run, redo its pages directly
+                    logger.warning(f"Message batch {batch.id} not done after {settings.batch_max_wait}s, "
+                                   "cancelling and using concurrent calls")
+                    self.client.messages.batches.cancel(batch.id)
+                    pending = [int(r["custom_id"].split("_")[1]) for r in requests]
+                    fallback = asyncio.run(self._extract_math_batch_async(
+                        [image_paths[i] for i in pending]
+                    ))
+                    for i, text in zip(pending, fallback):
+                        texts[i] = text
+                    return texts
+                
+                time.sleep(BATCH_POLL_INTERVAL)
+                batch = self.client.messages.batches.retrieve(batch.id)
+            
+            for entry in self.client.messages.batches.results(batch.id):
+                i = int(entry.custom_id.split("_")[1])
+                if entry.result.type != "succeeded":
+                    logger.error(f"Math OCR failed for {image_paths[i]}: {entry.result.type}")
+                    continue
+                
+                texts[i] = entry.result.message.content[0].text
+                logger.success(f"Extracted {len(texts[i])} chars of mathematical content")
+                self._store_text(keys[i], texts[i])
+                
+        except Exception as e:
+            logger.error(f"Math OCR batch failed: {e}")
+        
+        return texts
+    
+    async def _extract_math_batch_async(self, image_paths: List[Path]) -> List[Optional[str]]:
+        """Issue all math OCR requests at once, bounded by max_concurrent_api_calls"""
+        client = anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
+        semaphore = asyncio.Semaphore(settings.max_concurrent_api_calls)
+        
+        async def extract(image_path: Path) -> Optional[str]:
+            async with semaphore:
+                try:
+                    # Read the file once for both the cache key and the request
+                    image_bytes = await asyncio.to_thread(Path(image_path).read_bytes)
+                    
+                    key = await asyncio.to_thread(self._cache_key, image_bytes)
+                    cached = self._cached_text(key)
+                    if cached is not None:
+                        logger.debug(f"Math OCR cache hit for {image_path}")
+                        return cached
+                    
+                    # Base64 (and any recompression) is CPU-bound, keep it off the event loop
+                    request = await asyncio.to_thread(self._math_request, image_bytes)
+                    message = await client.messages.create(**request)
+                    
+                    extracted_text = message.content[0].text
+                    logger.success(f"Extracted {len(extracted_text)} chars of mathematical content")
+                    
+                    self._store_text(key, extracted_text)
+                    return extracted_text
+                    
+                except Exception as e:
+                    logger.error(f"Math OCR failed: {e}")
+                    return None
+        
+        async with client:
+            return await asyncio.gather(*[extract(path) for path in image_paths])
+    
     def extract_math_from_multiple_pages(self, image_paths: list[Path]) -> str:
         """
         Extract mathematical content from multiple pages
@@ -158,9 +241,10 @@ class MathOCR:
         """
         all_text = []
         
-        for i, img_path in enumerate(image_paths, 1):
-            logger.info(f"Extracting math from page {i}/{len(image_paths)}")
-            text = self.extract_math(img_path)
+        logger.info(f"Extracting math from {len(image_paths)} pages")
+        texts = self.extract_math_batch(image_paths)
+        
+        for i, text in enumerate(texts, 1):
             if text:
                 all_text.append(f"=== Page {i} ===\n{text}")
         
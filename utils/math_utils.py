@@ -1,3 +1,4 @@
+import functools
 import re
 import sympy as sp
 from sympy.parsing.latex import parse_latex
@@ -5,6 +6,64 @@ from typing import Optional, Tuple
 from loguru import logger
 
 
+# Common LaTeX commands and their SymPy equivalents, applied in order
+LATEX_REPLACEMENTS = [
+    (re.compile(pattern), replacement) for pattern, replacement in (
+        (r'\\frac\{([^}]+)\}\{([^}]+)\}', r'(\1)/(\2)'),
+        (r'\\sqrt\{([^}]+)\}', r'sqrt(\1)'),
+        (r'\\sin', 'sin'),
+        (r'\\cos', 'cos'),
+        (r'\\tan', 'tan'),
+        (r'\\log', 'log'),
+        (r'\\ln', 'ln'),
+        (r'\\pi', 'pi'),
+        (r'\\infty', 'oo'),
+        (r'\^', '**'),
+        (r'\\times', '*'),
+        (r'\\cdot', '*'),
+    )
+]
+
+TRAILING_UNIT_PATTERN = re.compile(r'[a-z]+$')
+FRACTION_PATTERN = re.compile(r'(-?\d+\.?\d*)\s*/\s*(-?\d+\.?\d*)')
+SCIENTIFIC_PATTERN = re.compile(r'(-?\d+\.?\d*)[eE](-?\d+)')
+NUMBER_PATTERN = re.compile(r'-?\d+\.?\d*')
+
+# Values substituted for every free symbol when checking equivalence numerically
+TEST_POINTS = (0, 1, -1, 2, 0.5)
+
+
+def _latex_to_sympy(latex_str: str) -> str:
+    """Convert common LaTeX notation to SymPy format"""
+    result = latex_str
+    for pattern, replacement in LATEX_REPLACEMENTS:
+        result = pattern.sub(replacement, result)
+    
+    return result
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_normalized(expr_str: str) -> Optional[sp.Expr]:
+    """Parse a delimiter-stripped expression (cached, SymPy expressions are immutable)"""
+    try:
+        # Try LaTeX parsing first
+        if '\\' in expr_str:
+            try:
+                return parse_latex(expr_str)
+            except:
+                pass
+        
+        # Replace common LaTeX commands with SymPy equivalents
+        expr_str = _latex_to_sympy(expr_str)
+        
+        # Try standard SymPy parsing
+        return sp.sympify(expr_str)
+        
+    except Exception as e:
+        logger.debug(f"Failed to parse expression '{expr_str}': {e}")
+        return None
+
+
 class MathProcessor:
     """Handle mathematical expression parsing and comparison"""
     
@@ -26,50 +85,8 @@ class MathProcessor:
         if not expr_str:
             return None
         
-        try:
-            # Remove LaTeX delimiters
-            expr_str = expr_str.strip()
-            expr_str = expr_str.replace('$', '')
-            
-            # Try LaTeX parsing first
-            if '\\' in expr_str:
-                try:
-                    return parse_latex(expr_str)
-                except:
-                    pass
-            
-            # Replace common LaTeX commands with SymPy equivalents
-            expr_str = self._latex_to_sympy(expr_str)
-            
-            # Try standard SymPy parsing
-            return sp.sympify(expr_str)
-            
-        except Exception as e:
-            logger.debug(f"Failed to parse expression '{expr_str}': {e}")
-            return None
-    
-    def _latex_to_sympy(self, latex_str: str) -> str:
-        """Convert common LaTeX notation to SymPy format"""
-        replacements = {
-            r'\\frac\{([^}]+)\}\{([^}]+)\}': r'(\1)/(\2)',
-            r'\\sqrt\{([^}]+)\}': r'sqrt(\1)',
-            r'\\sin': 'sin',
-            r'\\cos': 'cos',
-            r'\\tan': 'tan',
-            r'\\log': 'log',
-            r'\\ln': 'ln',
-            r'\\pi': 'pi',
-            r'\\infty': 'oo',
-            r'\^': '**',
-            r'\\times': '*',
-            r'\\cdot': '*',
-        }
-        
-        result = latex_str
-        for pattern, replacement in replacements.items():
-            result = re.sub(pattern, replacement, result)
-        
-        return result
+        # Remove LaTeX delimiters; repeated strings (model answers) parse once
+        return _parse_normalized(expr_str.strip().replace('$', ''))
     
     def extract_numerical_value(self, text: str) -> Optional[float]:
         """
@@ -90,7 +107,7 @@ class MathProcessor:
         try:
             # Remove common units and extra text
             text = text.lower().strip()
-            text = re.sub(r'[a-z]+$', '', text).strip()
+            text = TRAILING_UNIT_PATTERN.sub('', text).strip()
             
             # Try direct float conversion
             try:
@@ -99,7 +116,7 @@ class MathProcessor:
                 pass
             
             # Try fraction
-            fraction_match = re.search(r'(-?\d+\.?\d*)\s*/\s*(-?\d+\.?\d*)', text)
+            fraction_match = FRACTION_PATTERN.search(text)
             if fraction_match:
                 numerator = float(fraction_match.group(1))
                 denominator = float(fraction_match.group(2))
@@ -107,12 +124,12 @@ class MathProcessor:
                     return numerator / denominator
             
             # Try scientific notation
-            sci_match = re.search(r'(-?\d+\.?\d*)[eE](-?\d+)', text)
+            sci_match = SCIENTIFIC_PATTERN.search(text)
             if sci_match:
                 return float(text)
             
             # Try extracting any number
-            number_match = re.search(r'-?\d+\.?\d*', text)
+            number_match = NUMBER_PATTERN.search(text)
             if number_match:
                 return float(number_match.group())
             
@@ -142,31 +159,18 @@ class MathProcessor:
         
         if expr1 and expr2:
             try:
+                free_symbols = list(expr1.free_symbols | expr2.free_symbols)
+                
+                # Cheap numerical probe first: expressions that disagree at a
+                # test point cannot simplify to zero, so skip sp.simplify
+                all_close = self._agree_at_test_points(expr1, expr2, free_symbols, tolerance)
+                
                 # Symbolic equivalence
-                if sp.simplify(expr1 - expr2) == 0:
+                if all_close and sp.simplify(expr1 - expr2) == 0:
                     return True, 'exact'
                 
-                # Try numerical evaluation at multiple points
-                free_symbols = list(expr1.free_symbols | expr2.free_symbols)
-                if free_symbols:
-                    # Test at multiple points
-                    test_points = [0, 1, -1, 2, 0.5]
-                    all_close = True
-                    
-                    for val in test_points:
-                        subs = {sym: val for sym in free_symbols}
-                        try:
-                            val1 = float(expr1.subs(subs))
-                            val2 = float(expr2.subs(subs))
-                            
-                            if abs(val1 - val2) > max(abs(val1), abs(val2)) * tolerance:
-                                all_close = False
-                                break
-                        except:
-                            continue
-                    
-                    if all_close:
-                        return True, 'numerical'
+                if free_symbols and all_close:
+                    return True, 'numerical'
                 
             except Exception as e:
                 logger.debug(f"Symbolic comparison failed: {e}")
@@ -185,6 +189,29 @@ class MathProcessor:
         
         return False, 'different'
     
+    def _agree_at_test_points(self, expr1: sp.Expr, expr2: sp.Expr,
+                              free_symbols: list, tolerance: float) -> bool:
+        """
+        Check two expressions agree within tolerance at every test point
+        
+        Points where either expression cannot be evaluated to a real number
+        are skipped. Constant expressions are evaluated once.
+        """
+        test_points = TEST_POINTS if free_symbols else TEST_POINTS[:1]
+        
+        for val in test_points:
+            subs = {sym: val for sym in free_symbols}
+            try:
+                val1 = float(expr1.subs(subs))
+                val2 = float(expr2.subs(subs))
+            except Exception:
+                continue
+            
+            if abs(val1 - val2) > max(abs(val1), abs(val2)) * tolerance:
+                return False
+        
+        return True
+    
     def format_latex_for_display(self, expr: sp.Expr) -> str:
         """
         Format SymPy expression as LaTeX for display
@@ -1,12 +1,30 @@
+import cv2
 import pytesseract
-import easyocr
 import re
 from PIL import Image
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 from loguru import logger
 
 from config.settings import settings
 from models.schemas import OCRResult
+from utils.image_tools import ImageProcessor
+
+
+# Common math indicators, fused into one alternation so text is scanned once:
+# math symbols, Greek letters, exponents or fractions, LaTeX inline math,
+# LaTeX commands
+MATH_NOTATION_PATTERN = re.compile(
+    r'[∫∑∏√∞≠≤≥±×÷]'
+    r'|[α-ωΑ-Ω]'
+    r'|\^|\b\d+/\d+\b'
+    r'|\$.*?\$'
+    r'|\\[a-zA-Z]+\{'
+)
+INLINE_MATH_PATTERN = re.compile(r'\$(.*?)\$')
+DISPLAY_MATH_PATTERN = re.compile(r'\$\$(.*?)\$\$')
+
+# Pages with a smaller fraction of dark pixels than this count as blank
+BLANK_PAGE_INK_RATIO = 0.0005
 
 
 class OCREngine:
@@ -16,6 +34,8 @@ class OCREngine:
         self.reader = None
         if settings.use_multi_ocr:
             try:
+                # Imported here: easyocr pulls in torch, which is slow to import
+                import easyocr
                 self.reader = easyocr.Reader(['en'], gpu=settings.use_gpu)
                 logger.info("EasyOCR initialized successfully")
             except Exception as e:
@@ -32,12 +52,11 @@ class OCREngine:
             OCRResult object
         """
         try:
-            # Get OCR text and data
-            data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-            text = pytesseract.image_to_string(image)
+            # Get OCR text and word data from a single tesseract run
+            text, tsv = pytesseract.run_and_get_multiple_output(image, extensions=['txt', 'tsv'])
             
             # Calculate average confidence
-            confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
+            confidences = [conf for conf in self._tsv_confidences(tsv) if conf > 0]
             avg_confidence = sum(confidences) / len(confidences) / 100 if confidences else 0.0
             
             # Detect math notation
@@ -63,6 +82,24 @@ class OCREngine:
                 quality="poor"
             )
     
+    @staticmethod
+    def _tsv_confidences(tsv: str) -> List[int]:
+        """Word confidences from Tesseract TSV output, as image_to_data reports them"""
+        rows = tsv.strip().split('\n')
+        if len(rows) < 2:
+            return []
+        
+        conf_col = rows[0].split('\t').index('conf')
+        confidences = []
+        for row in rows[1:]:
+            cells = row.split('\t')
+            if len(cells) > conf_col:
+                try:
+                    confidences.append(int(float(cells[conf_col])))
+                except ValueError:
+                    continue
+        return confidences
+    
     def ocr_handwritten_text(self, image: Image.Image) -> OCRResult:
         """
         OCR for handwritten text using EasyOCR
@@ -78,65 +115,112 @@ class OCREngine:
             return self.ocr_printed_text(image)
         
         try:
-            # EasyOCR expects numpy array or image path
+            # EasyOCR expects numpy array or image path; it only reads the
+            # array, so a read-only view (one copy out of PIL, not two) is enough
             import numpy as np
-            img_array = np.array(image)
-            
-            results = self.reader.readtext(img_array)
+            img_array = np.asarray(image)
             
-            # Combine text and calculate average confidence
-            texts = []
-            confidences = []
-            for (bbox, text, conf) in results:
-                texts.append(text)
-                confidences.append(conf)
-            
-            combined_text = ' '.join(texts)
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-            
-            # Detect math notation
-            has_math = self._detect_math_notation(combined_text)
-            
-            return OCRResult(
-                text=combined_text.strip(),
-                confidence=avg_confidence,
-                engine="easyocr",
-                has_handwriting=True,
-                has_math=has_math,
-                quality="good" if avg_confidence > 0.7 else "fair" if avg_confidence > 0.5 else "poor"
-            )
+            return self._easyocr_result(self.reader.readtext(img_array))
             
         except Exception as e:
             logger.error(f"EasyOCR failed: {e}")
-            return OCRResult(
-                text="",
-                confidence=0.0,
-                engine="easyocr",
-                has_handwriting=True,
-                has_math=False,
-                quality="poor"
-            )
+            return self._easyocr_failed()
+    
+    def ocr_handwritten_batch(self, images: List[Image.Image]) -> List[OCRResult]:
+        """
+        OCR several handwritten pages with one EasyOCR detector pass
+        
+        Pages rendered from one PDF share a size, so their CRAFT detection runs
+        as a single batched forward pass. Pages of differing sizes are OCR'd one
+        at a time rather than resized, which would change what gets detected.
+        
+        Args:
+            images: PIL Images
+            
+        Returns:
+            OCRResult per image, in input order
+        """
+        if not self.reader or len(images) < 2:
+            return [self.ocr_handwritten_text(image) for image in images]
+        
+        import numpy as np
+        arrays = [np.asarray(image) for image in images]
+        if any(array.shape != arrays[0].shape for array in arrays):
+            return [self.ocr_handwritten_text(image) for image in images]
+        
+        try:
+            return [self._easyocr_result(results) for results in self.reader.readtext_batched(arrays)]
+        except Exception as e:
+            logger.warning(f"Batched EasyOCR failed, OCR'ing pages one at a time: {e}")
+            return [self.ocr_handwritten_text(image) for image in images]
+    
+    def _easyocr_result(self, results: list) -> OCRResult:
+        """Build an OCRResult from EasyOCR (bbox, text, confidence) detections"""
+        # Combine text and calculate average confidence
+        texts = []
+        confidences = []
+        for (bbox, text, conf) in results:
+            texts.append(text)
+            confidences.append(conf)
+        
+        combined_text = ' '.join(texts)
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        
+        # Detect math notation
+        has_math = self._detect_math_notation(combined_text)
+        
+        return OCRResult(
+            text=combined_text.strip(),
+            confidence=avg_confidence,
+            engine="easyocr",
+            has_handwriting=True,
+            has_math=has_math,
+            quality="good" if avg_confidence > 0.7 else "fair" if avg_confidence > 0.5 else "poor"
+        )
+    
+    @staticmethod
+    def _easyocr_failed() -> OCRResult:
+        """Empty EasyOCR result for a page that could not be read"""
+        return OCRResult(
+            text="",
+            confidence=0.0,
+            engine="easyocr",
+            has_handwriting=True,
+            has_math=False,
+            quality="poor"
+        )
     
     def intelligent_ocr(self, image: Image.Image, 
-                       is_handwritten: bool = False) -> OCRResult:
+                       is_handwritten: bool = False,
+                       primary: Optional[OCRResult] = None) -> OCRResult:
         """
         Intelligently select OCR engine based on content type
         
         Args:
             image: PIL Image
             is_handwritten: Whether the image likely contains handwriting
+            primary: Result of the first-choice engine, if already computed
+                     (e.g. by ocr_handwritten_batch)
             
         Returns:
             OCRResult object
         """
         # Try appropriate engine first
-        if is_handwritten:
+        if primary is not None:
+            result = primary
+        elif is_handwritten:
             result = self.ocr_handwritten_text(image)
         else:
             result = self.ocr_printed_text(image)
         
         # If confidence is low and multi-OCR is enabled, try other engine
         if settings.use_multi_ocr and result.confidence < settings.ocr_confidence_threshold:
+            # Low confidence on a blank page only means there is nothing to
+            # read; the other engine would not find anything either
+            if len(result.text.strip()) < settings.min_text_chars and self._is_blank(image):
+                logger.debug("Blank page, skipping alternative OCR")
+                return result
+            
             logger.info(f"Low confidence ({result.confidence:.2f}), trying alternative OCR")
             
             if is_handwritten:
@@ -151,30 +235,24 @@ class OCREngine:
         
         return result
     
+    @staticmethod
+    def _is_blank(image: Image.Image) -> bool:
+        """Whether an image has (almost) no dark pixels, i.e. nothing written on it"""
+        gray = ImageProcessor.pil_to_gray(image)
+        _, ink = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY_INV)
+        return cv2.countNonZero(ink) < BLANK_PAGE_INK_RATIO * gray.size
+    
     def _detect_math_notation(self, text: str) -> bool:
         """Detect if text contains mathematical notation"""
-        # Common math indicators
-        math_patterns = [
-            r'[∫∑∏√∞≠≤≥±×÷]',  # Math symbols
-            r'[α-ωΑ-Ω]',  # Greek letters
-            r'\^|\b\d+/\d+\b',  # Exponents or fractions
-            r'\$.*?\$',  # LaTeX inline math
-            r'\\[a-zA-Z]+\{',  # LaTeX commands
-        ]
-        
-        for pattern in math_patterns:
-            if re.search(pattern, text):
-                return True
-        
-        return False
+        return MATH_NOTATION_PATTERN.search(text) is not None
     
     def _extract_latex_equations(self, text: str) -> list:
         """Extract LaTeX equations from text"""
         # Find inline math ($...$)
-        inline = re.findall(r'\$(.*?)\$', text)
+        inline = INLINE_MATH_PATTERN.findall(text)
         
         # Find display math ($$...$$)
-        display = re.findall(r'\$\$(.*?)\$\$', text)
+        display = DISPLAY_MATH_PATTERN.findall(text)
         
         return inline + display
     
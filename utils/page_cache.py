@@ -0,0 +1,61 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, Optional, Union
+from loguru import logger
+from pydantic_core import from_json, to_json
+
+
+class PageCache:
+    """On-disk JSON cache of per-page results (detections, OCR) keyed by page content"""
+    
+    def __init__(self, cache_dir: Path):
+        """
+        Args:
+            cache_dir: Directory holding one JSON file per cached page
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+    
+    def key(self, image: Union[str, Path, bytes], *context: str) -> str:
+        """
+        Content hash of a page file
+        
+        Args:
+            image: Path to page image, or its already-read file bytes
+            context: Extra strings that affect the result (model, prompt, settings)
+        
+        Returns:
+            Hex digest identifying the page and processing setup
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        if isinstance(image, bytes):
+            digest.update(image)
+        else:
+            with open(image, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        for part in context:
+            digest.update(part.encode('utf-8'))
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Cached value for a key, or None on miss"""
+        path = self.cache_dir / f"{key}.json"
+        try:
+            return from_json(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to read page cache {path}: {e}")
+            return None
+    
+    def put(self, key: str, value: Any):
+        """Store a JSON-serializable value for a key"""
+        path = self.cache_dir / f"{key}.json"
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp_path.write_bytes(to_json(value))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to write page cache {path}: {e}")
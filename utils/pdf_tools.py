@@ -1,9 +1,7 @@
 import fitz  # PyMuPDF
-from pdf2image import convert_from_path
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 from PIL import Image
-import pdfplumber
 from loguru import logger
 
 from config.settings import settings
@@ -25,16 +23,29 @@ class PDFProcessor:
         Returns:
             List of PIL Image objects
         """
+        images = list(self.iter_pages(pdf_path))
+        logger.success(f"Converted {len(images)} pages to images")
+        return images
+    
+    def iter_pages(self, pdf_path: str) -> Iterator[Image.Image]:
+        """
+        Render PDF pages one at a time, so callers can process each page
+        before the next is rasterized
+        
+        Args:
+            pdf_path: Path to PDF file
+            
+        Yields:
+            PIL Image per page, in page order
+        """
         try:
             logger.info(f"Converting PDF to images at {self.dpi} DPI: {pdf_path}")
-            images = convert_from_path(
-                pdf_path,
-                dpi=self.dpi,
-                fmt='PNG',
-                thread_count=4 if settings.parallel_processing else 1
-            )
-            logger.success(f"Converted {len(images)} pages to images")
-            return images
+            
+            # Render in-process with MuPDF; no Poppler subprocess or PPM round-trip
+            with fitz.open(pdf_path) as doc:
+                for page in doc:
+                    pix = page.get_pixmap(dpi=self.dpi, alpha=False)
+                    yield Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
         except Exception as e:
             logger.error(f"Failed to convert PDF to images: {e}")
             raise
@@ -85,6 +96,10 @@ class PDFProcessor:
             List of text strings, one per page
         """
         try:
+            # Imported here: pdfplumber pulls in pdfminer, which is slow to import
+            # and only needed by this rarely used path
+            import pdfplumber
+            
             texts = []
             with pdfplumber.open(pdf_path) as pdf:
                 for page in pdf.pages:
@@ -112,12 +127,23 @@ class PDFProcessor:
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
         
-        saved_paths = []
-        for i, img in enumerate(images, 1):
-            filepath = output_path / f"{prefix}_{i:03d}.png"
-            img.save(filepath, "PNG", quality=95, optimize=False)
-            saved_paths.append(str(filepath))
-            logger.debug(f"Saved image: {filepath}")
+        saved_paths = [self.save_image(img, output_path, i, prefix)
+                       for i, img in enumerate(images, 1)]
         
         logger.success(f"Saved {len(saved_paths)} images to {output_dir}")
         return saved_paths
+    
+    def save_image(self, image: Image.Image, output_dir: Path, page_num: int,
+                   prefix: str = "page") -> str:
+        """
+        Save one page image as <prefix>_<page_num>.png in an existing directory
+        
+        Returns:
+            Saved file path
+        """
+        filepath = output_dir / f"{prefix}_{page_num:03d}.png"
+        # Fastest DEFLATE level: pages are written once per run and are
+        # working files, so encode time matters more than a smaller file
+        image.save(filepath, "PNG", compress_level=1)
+        logger.debug(f"Saved image: {filepath}")
+        return str(filepath)
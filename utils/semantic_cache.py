@@ -0,0 +1,129 @@
+import json
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional, Set
+from loguru import logger
+
+
+class SemanticCache:
+    """
+    Cache of AI grading responses keyed by answer embedding similarity
+    
+    An embedding match alone is not a hit: MiniLM scores answers that differ
+    only in a number ("x = 42" / "x = 24") above any useful threshold, so the
+    stored answer text must also match after whitespace normalization.
+    """
+    
+    def __init__(self, threshold: float = 0.92, cache_dir: Optional[Path] = None):
+        """
+        Args:
+            threshold: Minimum cosine similarity for a cache hit
+            cache_dir: Directory to persist entries between runs (None = memory only)
+        """
+        self.threshold = threshold
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        
+        # namespace -> (embedding matrix, normalized answer texts, responses)
+        self._entries: Dict[str, tuple] = {}
+        # Namespaces with entries not yet written to disk
+        self._dirty: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Collapse whitespace runs, the only difference two cached answers may have"""
+        return ' '.join(text.split())
+    
+    def _load(self, namespace: str) -> tuple:
+        """Get entries for a namespace, loading them from disk on first use"""
+        if namespace in self._entries:
+            return self._entries[namespace]
+        
+        embeddings = np.empty((0, 0), dtype=np.float32)
+        texts = []
+        responses = []
+        
+        if self.cache_dir:
+            path = self.cache_dir / f"{namespace}.npz"
+            if path.exists():
+                try:
+                    with np.load(path) as data:
+                        if 'texts' in data:
+                            embeddings = data['embeddings']
+                            texts = [str(t) for t in data['texts']]
+                            responses = [json.loads(r) for r in data['responses']]
+                    logger.debug(f"Loaded {len(responses)} cached gradings for {namespace}")
+                except Exception as e:
+                    logger.warning(f"Failed to load grading cache {path}: {e}")
+        
+        self._entries[namespace] = (embeddings, texts, responses)
+        return self._entries[namespace]
+    
+    def lookup(self, namespace: str, embedding: np.ndarray, text: str) -> Optional[Dict]:
+        """
+        Find a cached response for the same answer
+        
+        Args:
+            namespace: Cache partition (e.g. one per question)
+            embedding: L2-normalized answer embedding
+            text: Answer text the embedding was computed from
+        
+        Returns:
+            Cached response dictionary or None on miss
+        """
+        with self._lock:
+            embeddings, texts, responses = self._load(namespace)
+        
+        if responses:
+            similarities = embeddings @ embedding
+            normalized = self.normalize(text)
+            for i in np.flatnonzero(similarities >= self.threshold):
+                if texts[i] == normalized:
+                    self.hits += 1
+                    logger.debug(f"Grading cache hit for {namespace} "
+                                 f"(similarity: {similarities[i]:.3f})")
+                    return dict(responses[i])
+        
+        self.misses += 1
+        return None
+    
+    def store(self, namespace: str, embedding: np.ndarray, text: str, response: Dict):
+        """
+        Add a response to the cache (in memory; call flush() to persist)
+        
+        Args:
+            namespace: Cache partition (e.g. one per question)
+            embedding: L2-normalized answer embedding
+            text: Answer text the embedding was computed from
+            response: Grading response dictionary
+        """
+        with self._lock:
+            embeddings, texts, responses = self._load(namespace)
+            
+            row = np.asarray(embedding, dtype=np.float32)[np.newaxis, :]
+            embeddings = np.vstack([embeddings, row]) if responses else row
+            self._entries[namespace] = (embeddings, texts + [self.normalize(text)],
+                                        responses + [response])
+            self._dirty.add(namespace)
+    
+    def flush(self):
+        """Write namespaces changed since the last flush to disk"""
+        if not self.cache_dir:
+            return
+        
+        with self._lock:
+            for namespace in self._dirty:
+                embeddings, texts, responses = self._entries[namespace]
+                try:
+                    np.savez(self.cache_dir / f"{namespace}.npz",
+                             embeddings=embeddings,
+                             texts=np.array(texts),
+                             responses=np.array([json.dumps(r) for r in responses]))
+                except Exception as e:
+                    logger.warning(f"Failed to persist grading cache for {namespace}: {e}")
+            self._dirty.clear()
@@ -1,9 +1,12 @@
 import anthropic
+import asyncio
 import base64
 import json
+import re
+import threading
 from PIL import Image
 from io import BytesIO
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from loguru import logger
 
 from config.settings import settings
@@ -11,21 +14,134 @@ from config.prompts import *
 from models.schemas import OCRResult, BoundingBox, Diagram
 
 
+# API limit on a single base64-encoded image
+MAX_IMAGE_BASE64_BYTES = 5 * 1024 * 1024
+
+# JSON string values (content between quotes), for repairing AI responses
+JSON_STRING_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+
+def _escape_control_chars(match: re.Match) -> str:
+    """Escape raw newlines/tabs inside a matched JSON string, keeping the quotes"""
+    return match.group(0).replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+
+
+def _extract_json_str(response_text: str) -> str:
+    """
+    Extract the JSON payload from a model response
+    
+    Claude sometimes wraps JSON in a markdown code block (```json or plain ```)
+    or surrounds it with prose; the first code block wins, otherwise the span
+    from the first { to the last } is used.
+    """
+    if "```json" in response_text:
+        return response_text.partition("```json")[2].partition("```")[0].strip()
+    if "```" in response_text:
+        return response_text.partition("```")[2].partition("```")[0].strip()
+    
+    start_idx = response_text.find('{')
+    end_idx = response_text.rfind('}')
+    if start_idx != -1 and end_idx > start_idx:
+        return response_text[start_idx:end_idx+1]
+    return response_text.strip()
+
+
+def _base64_size(nbytes: int) -> int:
+    """Length of the base64 encoding of nbytes bytes"""
+    return 4 * ((nbytes + 2) // 3)
+
+
+def _encode_image(image: Image.Image, fmt: str = "PNG") -> Tuple[str, str]:
+    """
+    Encode a PIL Image for the API, downscaled to the vision size cap
+    
+    Args:
+        image: PIL Image
+        fmt: "PNG" (lossless, for handwriting and diagrams) or "JPEG"
+             (several times smaller, for printed pages)
+    
+    Returns:
+        (media type, base64 data); images over the API limit as PNG are
+        re-encoded as JPEG, shrinking them further if needed
+    """
+    # The API downsamples large images anyway; shrinking first cuts encode and upload time
+    max_size = settings.vision_max_image_size
+    if max_size > 0 and max(image.size) > max_size:
+        image = image.copy()
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    
+    buffered = BytesIO()
+    if fmt != "JPEG":
+        image.save(buffered, format="PNG")
+        # getbuffer() encodes straight from the buffer without copying it
+        if _base64_size(buffered.getbuffer().nbytes) <= MAX_IMAGE_BASE64_BYTES:
+            return "image/png", base64.b64encode(buffered.getbuffer()).decode()
+        logger.warning(f"PNG of {buffered.getbuffer().nbytes/1024/1024:.2f}MB is over the API limit, using JPEG")
+    
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    
+    while True:
+        buffered = BytesIO()
+        image.save(buffered, format="JPEG", quality=85)
+        size = buffered.getbuffer().nbytes
+        if _base64_size(size) <= MAX_IMAGE_BASE64_BYTES:
+            return "image/jpeg", base64.b64encode(buffered.getbuffer()).decode()
+        
+        # Shrink both sides by the square root of the excess, with some margin
+        ratio = 0.9 * (MAX_IMAGE_BASE64_BYTES / _base64_size(size)) ** 0.5
+        new_size = (max(1, int(image.width * ratio)), max(1, int(image.height * ratio)))
+        logger.info(f"Resizing from {image.width}x{image.height} to {new_size[0]}x{new_size[1]}")
+        image = image.resize(new_size, Image.LANCZOS)
+
+
+def image_source(image: Union[Image.Image, bytes], fmt: str = "PNG") -> Dict:
+    """
+    Build a base64 image source, forwarding encoded file bytes without decoding
+    
+    PNG/JPEG file bytes (detected by their magic bytes) within the vision size
+    cap and the API's 5MB limit are sent as they are; other bytes are decoded
+    and encoded like PIL Images, whose encoding fmt picks.
+    """
+    if isinstance(image, bytes):
+        is_png = image[:8] == b"\x89PNG\r\n\x1a\n"
+        is_jpeg = image[:3] == b"\xff\xd8\xff"
+        
+        # Only the header is read here; oversized images are downscaled below
+        with Image.open(BytesIO(image)) as header:
+            long_side = max(header.size)
+        max_size = settings.vision_max_image_size
+        fits = max_size <= 0 or long_side <= max_size
+        
+        if (is_png or is_jpeg) and fits and _base64_size(len(image)) <= MAX_IMAGE_BASE64_BYTES:
+            return {
+                "type": "base64",
+                "media_type": "image/png" if is_png else "image/jpeg",
+                "data": base64.b64encode(image).decode(),
+            }
+        
+        image = Image.open(BytesIO(image))
+    
+    media_type, data = _encode_image(image, fmt)
+    return {
+        "type": "base64",
+        "media_type": media_type,
+        "data": data,
+    }
+
 class ClaudeVisionAPI:
     """Interface to Claude Vision API for advanced OCR and analysis"""
     
+    # Attempts per async request on rate-limit / transient errors
+    MAX_RETRIES = 3
+    
     def __init__(self):
         self.client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
         self.model = settings.anthropic_model
         self.total_input_tokens = 0
         self.total_output_tokens = 0
         self.total_cost = 0.0
-    
-    def _image_to_base64(self, image: Image.Image) -> str:
-        """Convert PIL Image to base64 string"""
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode()
+        self._cost_lock = threading.Lock()
     
     def _track_cost(self, usage):
         """Track API usage and costs"""
@@ -35,16 +151,103 @@ class ClaudeVisionAPI:
         input_tokens = usage.input_tokens
         output_tokens = usage.output_tokens
         
-        self.total_input_tokens += input_tokens
-        self.total_output_tokens += output_tokens
-        
         cost = (input_tokens * settings.input_token_cost + 
                 output_tokens * settings.output_token_cost)
-        self.total_cost += cost
+        
+        # Grading calls may run concurrently from worker threads
+        with self._cost_lock:
+            self.total_input_tokens += input_tokens
+            self.total_output_tokens += output_tokens
+            self.total_cost += cost
         
         if settings.track_api_costs:
             logger.debug(f"API call: {input_tokens} in, {output_tokens} out, ${cost:.4f}")
     
+    @staticmethod
+    def async_client() -> anthropic.AsyncAnthropic:
+        """
+        New async client for one event loop run
+        
+        Its connection pool is bound to the loop it is first used on, so each
+        asyncio.run entry point opens its own with `async with` (which closes it)
+        and passes it to the *_async methods.
+        """
+        return anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
+    
+    async def _create_message_async(self, client: anthropic.AsyncAnthropic, **kwargs):
+        """Create a message with the async client, retrying with exponential backoff"""
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                return await client.messages.create(**kwargs)
+            except (anthropic.RateLimitError, anthropic.APIConnectionError,
+                    anthropic.InternalServerError) as e:
+                if attempt == self.MAX_RETRIES - 1:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"API call failed ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+    
+    def _image_request(self, image: Image.Image, prompt: str, max_tokens: int,
+                       fmt: str = "PNG") -> Dict:
+        """Build message parameters for a single-image prompt"""
+        return dict(
+            model=self.model,
+            max_tokens=max_tokens,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": image_source(image, fmt),
+                        },
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ],
+                }
+            ],
+        )
+    
+    @staticmethod
+    def _ocr_format(is_handwritten: bool) -> str:
+        """Upload encoding for OCR: lossless for handwriting, JPEG for printed pages"""
+        return "PNG" if is_handwritten else "JPEG"
+    
+    def _ocr_result(self, text: str, is_handwritten: bool) -> OCRResult:
+        """Build OCRResult from Claude Vision response text"""
+        # Claude Vision doesn't provide confidence scores, estimate based on content
+        confidence = 0.85 if is_handwritten else 0.95
+        
+        return OCRResult(
+            text=text.strip(),
+            confidence=confidence,
+            engine="claude_vision",
+            has_handwriting=is_handwritten,
+            has_math="$" in text or "\\" in text,
+            quality="good"
+        )
+    
+    def _failed_ocr_result(self, is_handwritten: bool) -> OCRResult:
+        """OCRResult returned when Claude Vision OCR fails"""
+        return OCRResult(
+            text="",
+            confidence=0.0,
+            engine="claude_vision",
+            has_handwriting=is_handwritten,
+            has_math=False,
+            quality="poor"
+        )
+    
+    def _parse_diagrams(self, response_text: str) -> List[Dict]:
+        """Parse diagram list from detection response"""
+        result = json.loads(_extract_json_str(response_text))
+        diagrams = result.get("diagrams", [])
+        
+        logger.info(f"Detected {len(diagrams)} diagrams using AI")
+        return diagrams
+    
     def ocr_with_vision(self, image: Image.Image, 
                        is_handwritten: bool = True) -> OCRResult:
         """
@@ -58,58 +261,36 @@ class ClaudeVisionAPI:
             OCRResult object
         """
         try:
-            image_base64 = self._image_to_base64(image)
-            
             message = self.client.messages.create(
-                model=self.model,
-                max_tokens=2048,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": image_base64,
-                                },
-                            },
-                            {
-                                "type": "text",
-                                "text": HANDWRITING_OCR_PROMPT
-                            }
-                        ],
-                    }
-                ],
+                **self._image_request(image, HANDWRITING_OCR_PROMPT, max_tokens=2048,
+                                      fmt=self._ocr_format(is_handwritten))
             )
             
             self._track_cost(message.usage)
             
-            text = message.content[0].text
+            return self._ocr_result(message.content[0].text, is_handwritten)
             
-            # Claude Vision doesn't provide confidence scores, estimate based on content
-            confidence = 0.85 if is_handwritten else 0.95
-            
-            return OCRResult(
-                text=text.strip(),
-                confidence=confidence,
-                engine="claude_vision",
-                has_handwriting=is_handwritten,
-                has_math="$" in text or "\\" in text,
-                quality="good"
+        except Exception as e:
+            logger.error(f"Claude Vision OCR failed: {e}")
+            return self._failed_ocr_result(is_handwritten)
+    
+    async def ocr_with_vision_async(self, client: anthropic.AsyncAnthropic, image: Image.Image,
+                                    is_handwritten: bool = True) -> OCRResult:
+        """Async version of ocr_with_vision, for issuing many pages concurrently"""
+        try:
+            request = await asyncio.to_thread(
+                self._image_request, image, HANDWRITING_OCR_PROMPT, 2048,
+                self._ocr_format(is_handwritten)
             )
+            message = await self._create_message_async(client, **request)
+            
+            self._track_cost(message.usage)
+            
+            return self._ocr_result(message.content[0].text, is_handwritten)
             
         except Exception as e:
             logger.error(f"Claude Vision OCR failed: {e}")
-            return OCRResult(
-                text="",
-                confidence=0.0,
-                engine="claude_vision",
-                has_handwriting=is_handwritten,
-                has_math=False,
-                quality="poor"
-            )
+            return self._failed_ocr_result(is_handwritten)
     
     def detect_diagrams(self, image: Image.Image) -> List[Dict]:
         """
@@ -122,50 +303,31 @@ class ClaudeVisionAPI:
             List of diagram dictionaries with bbox, type, description
         """
         try:
-            image_base64 = self._image_to_base64(image)
-            
             message = self.client.messages.create(
-                model=self.model,
-                max_tokens=1024,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": image_base64,
-                                },
-                            },
-                            {
-                                "type": "text",
-                                "text": DIAGRAM_DETECTION_PROMPT
-                            }
-                        ],
-                    }
-                ],
+                **self._image_request(image, DIAGRAM_DETECTION_PROMPT, max_tokens=1024)
             )
             
             self._track_cost(message.usage)
             
-            response_text = message.content[0].text
+            return self._parse_diagrams(message.content[0].text)
             
-            # Parse JSON response
-            # Sometimes Claude wraps JSON in markdown code blocks
-            if "```json" in response_text:
-                json_str = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                json_str = response_text.split("```")[1].split("```")[0].strip()
-            else:
-                json_str = response_text.strip()
+        except Exception as e:
+            logger.error(f"AI diagram detection failed: {e}")
+            return []
+    
+    async def detect_diagrams_async(self, client: anthropic.AsyncAnthropic,
+                                    image: Image.Image) -> List[Dict]:
+        """Async version of detect_diagrams, for issuing many pages concurrently"""
+        try:
+            # PNG encoding is CPU-bound, keep it off the event loop
+            request = await asyncio.to_thread(
+                self._image_request, image, DIAGRAM_DETECTION_PROMPT, 1024
+            )
+            message = await self._create_message_async(client, **request)
             
-            result = json.loads(json_str)
-            diagrams = result.get("diagrams", [])
+            self._track_cost(message.usage)
             
-            logger.info(f"Detected {len(diagrams)} diagrams using AI")
-            return diagrams
+            return self._parse_diagrams(message.content[0].text)
             
         except Exception as e:
             logger.error(f"AI diagram detection failed: {e}")
@@ -183,30 +345,8 @@ class ClaudeVisionAPI:
             Analysis text
         """
         try:
-            image_base64 = self._image_to_base64(image)
-            
             message = self.client.messages.create(
-                model=self.model,
-                max_tokens=4096,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": image_base64,
-                                },
-                            },
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ],
-                    }
-                ],
+                **self._image_request(image, prompt, max_tokens=4096, fmt="JPEG")
             )
             
             self._track_cost(message.usage)
@@ -267,48 +407,21 @@ class ClaudeVisionAPI:
             
             logger.debug(f"AI grading response: {response_text}")
             
-            # Parse JSON response - try multiple extraction methods
-            json_str = None
-            
-            # Method 1: Look for ```json code blocks
-            if "```json" in response_text:
-                json_str = response_text.split("```json")[1].split("```")[0].strip()
-            # Method 2: Look for any ``` code blocks
-            elif "```" in response_text:
-                json_str = response_text.split("```")[1].split("```")[0].strip()
-            # Method 3: Extract JSON object using regex (handle multi-line)
-            else:
-                import re
-                # Find the first { and last } to extract the JSON object
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}')
-                if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx+1]
-                else:
-                    json_str = response_text.strip()
+            # Parse JSON response (code block, or the outermost {...})
+            json_str = _extract_json_str(response_text)
             
             logger.debug(f"Extracted JSON string: {json_str[:200]}...")
             
-            # Try to parse, if it fails due to control characters, fix them
+            # Feedback often contains raw newlines/tabs inside strings; strict=False
+            # accepts control characters there in the same single parse
             try:
-                result = json.loads(json_str)
+                result = json.loads(json_str, strict=False)
             except json.JSONDecodeError as e:
-                # Try fixing common JSON issues (unescaped newlines in strings)
+                # Rarer breakage such as a backslash before a raw newline: escape
+                # control characters inside string values and retry
                 logger.warning(f"Initial JSON parse failed: {e}, attempting repair...")
                 try:
-                    # Use ast.literal_eval as fallback or try manual escaping
-                    # Replace unescaped control characters within the JSON
-                    import re
-                    # Find all string values and escape newlines/tabs/etc
-                    def escape_string_content(match):
-                        s = match.group(0)
-                        # Keep the quotes, escape the content
-                        s = s.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
-                        return s
-                    
-                    # This regex matches JSON string values (content between quotes)
-                    json_str_fixed = re.sub(r'"[^"\\]*(?:\\.[^"\\]*)*"', escape_string_content, json_str, flags=re.DOTALL)
-                    result = json.loads(json_str_fixed)
+                    result = json.loads(JSON_STRING_PATTERN.sub(_escape_control_chars, json_str))
                     logger.success("JSON repair successful")
                 except Exception as repair_error:
                     logger.error(f"JSON repair also failed: {repair_error}")
@@ -334,21 +447,21 @@ class ClaudeVisionAPI:
                 "confidence": 0.0
             }
     
-    def compare_diagrams(self, correct_diagram: Image.Image, 
-                        student_diagram: Image.Image) -> Dict:
+    def compare_diagrams(self, correct_diagram: Union[Image.Image, bytes], 
+                        student_diagram: Union[Image.Image, bytes]) -> Dict:
         """
         Compare two diagrams for similarity
         
         Args:
-            correct_diagram: Reference diagram
-            student_diagram: Student's diagram
+            correct_diagram: Reference diagram (PIL Image or PNG/JPEG file bytes)
+            student_diagram: Student's diagram (PIL Image or PNG/JPEG file bytes)
             
         Returns:
             Comparison result dictionary
         """
         try:
-            correct_b64 = self._image_to_base64(correct_diagram)
-            student_b64 = self._image_to_base64(student_diagram)
+            correct_source = image_source(correct_diagram)
+            student_source = image_source(student_diagram)
             
             message = self.client.messages.create(
                 model=self.model,
@@ -363,11 +476,7 @@ class ClaudeVisionAPI:
                             },
                             {
                                 "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": correct_b64,
-                                },
+                                "source": correct_source,
                             },
                             {
                                 "type": "text",
@@ -375,11 +484,7 @@ class ClaudeVisionAPI:
                             },
                             {
                                 "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": student_b64,
-                                },
+                                "source": student_source,
                             },
                             {
                                 "type": "text",
@@ -395,15 +500,7 @@ class ClaudeVisionAPI:
             response_text = message.content[0].text
             
             # Parse JSON response
-            if "```json" in response_text:
-                json_str = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                json_str = response_text.split("```")[1].split("```")[0].strip()
-            else:
-                json_str = response_text.strip()
-            
-            result = json.loads(json_str)
-            return result
+            return json.loads(_extract_json_str(response_text))
             
         except Exception as e:
             logger.error(f"Diagram comparison failed: {e}")